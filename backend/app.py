@@ -15,6 +15,7 @@ from blueprints.category import category_bp
 from blueprints.orders import order_bp
 from blueprints.search import search_bp
 from blueprints.admin_dashboard import dashboard_bp
+from category_cache import category_cache
 
 app = Flask(__name__)
 
@@ -86,6 +87,13 @@ app.register_blueprint(order_bp)
 app.register_blueprint(search_bp)
 app.register_blueprint(dashboard_bp)
 
+# Warm the slug -> id cache; it is built lazily on first use if the DB is down now
+with app.app_context():
+    try:
+        category_cache.refresh()
+    except SQLAlchemyError as e:
+        print(f"Category cache not warmed: {e}")
+
 if __name__ == "__main__":
     with app.app_context():
         db.create_all() 
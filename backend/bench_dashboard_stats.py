@@ -0,0 +1,232 @@
+"""
+Benchmark for GET /api/admin/dashboard/stats.
+
+Seeds a scratch database with a million orders, then times each way of
+computing the order KPIs:
+
+    legacy    the original 18 queries (one aggregate per KPI card)
+    filter    one pass over orders with FILTER clauses
+    endpoint  the endpoint as shipped (daily_sales rollup + customer sketches)
+    exact     the endpoint with exact=true (COUNT DISTINCT phones on orders)
+
+The database is WIPED; never point this at real data:
+
+    python bench_dashboard_stats.py --database-url postgresql://postgres@localhost/fashionhub_bench
+    python bench_dashboard_stats.py --database-url ... --skip-seed   # reuse the last seed
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import timedelta
+
+ORDERS = 1_000_000
+CUSTOMERS = 150_000
+DAYS = 400
+REPEAT = 5
+
+STATUSES = ['pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']
+
+
+# ==================== SEEDING ====================
+
+def seed(db, orders, customers, days):
+    """Recreate the schema and bulk-insert `orders` orders spread over `days` days"""
+    from models import Gender, Product, ProductType
+
+    db.drop_all()
+    db.create_all()
+
+    gender = Gender(name='Bench', slug='bench')
+    product_type = ProductType(name='Bench', slug='bench', gender=gender)
+    db.session.add_all([
+        Product(title=f'Bench product {i}', price=20 + i % 80, product_type=product_type,
+                in_stock=i % 7 != 0, is_new=i % 5 == 0, is_sale=i % 3 == 0, sales_count=i)
+        for i in range(500)
+    ])
+    db.session.commit()
+
+    # Generated server side; values derive from g so reruns seed the same data
+    db.session.execute(db.text("""
+        INSERT INTO orders (order_number, customer_name, customer_phone, address_line1, city,
+                            subtotal, shipping_cost, total, item_count, status, payment_status, created_at)
+        SELECT 'BENCH-' || g,
+               'Customer ' || g % :customers,
+               '+961 ' || lpad((g * 7919 % :customers)::text, 8, '0'),
+               'Hamra St', 'Beirut',
+               20 + g * 37 % 180, 10, 30 + g * 37 % 180,
+               1 + g % 4,
+               (:statuses)[1 + g % 6],
+               'pending',
+               now() - make_interval(secs => (g * 104729 % (:days * 86400))::double precision)
+        FROM generate_series(1::bigint, :orders) AS g
+    """), {'orders': orders, 'customers': customers, 'days': days, 'statuses': STATUSES})
+    db.session.commit()
+
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.exec_driver_sql('VACUUM ANALYZE orders')
+        conn.exec_driver_sql('VACUUM ANALYZE products')
+
+
+# ==================== VARIANTS ====================
+
+def periods():
+    from blueprints.admin_dashboard import get_lebanon_now
+
+    now = get_lebanon_now()
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    last_month_start = (today_start.replace(day=1) - timedelta(days=1)).replace(day=1)
+    this_month_start = today_start.replace(day=1)
+    return today_start, this_month_start, last_month_start
+
+
+def legacy_stats(db):
+    """The order and product KPIs as originally computed: one query per number"""
+    from sqlalchemy import func
+    from models import Order, Product
+
+    today_start, this_month_start, last_month_start = periods()
+    revenue = lambda *conditions: db.session.query(
+        func.coalesce(func.sum(Order.total), 0)
+    ).filter(Order.status != 'cancelled', *conditions).scalar()
+    customers = lambda *conditions: db.session.query(
+        func.count(func.distinct(Order.customer_phone))
+    ).filter(*conditions).scalar()
+    last_month = (Order.created_at >= last_month_start, Order.created_at < this_month_start)
+
+    return {
+        'total_revenue': revenue(),
+        'today_revenue': revenue(Order.created_at >= today_start),
+        'this_month_revenue': revenue(Order.created_at >= this_month_start),
+        'last_month_revenue': revenue(*last_month),
+        'total_orders': Order.query.count(),
+        'today_orders': Order.query.filter(Order.created_at >= today_start).count(),
+        'pending': Order.query.filter_by(status='pending').count(),
+        'this_month_orders': Order.query.filter(Order.created_at >= this_month_start).count(),
+        'last_month_orders': Order.query.filter(*last_month).count(),
+        'status_counts': dict(db.session.query(Order.status, func.count(Order.id)).group_by(Order.status).all()),
+        'products': [
+            Product.query.count(),
+            Product.query.filter_by(in_stock=True).count(),
+            Product.query.filter_by(in_stock=False).count(),
+            Product.query.filter_by(is_new=True).count(),
+            Product.query.filter_by(is_sale=True).count(),
+        ],
+        'total_customers': customers(),
+        'this_month_customers': customers(Order.created_at >= this_month_start),
+        'last_month_customers': customers(*last_month),
+    }
+
+
+def filter_stats(db):
+    """The same KPIs from one orders pass and one products pass"""
+    from sqlalchemy import and_, func
+    from models import Order, Product
+
+    today_start, this_month_start, last_month_start = periods()
+    not_cancelled = Order.status != 'cancelled'
+    today = Order.created_at >= today_start
+    this_month = Order.created_at >= this_month_start
+    last_month = and_(Order.created_at >= last_month_start, Order.created_at < this_month_start)
+
+    def revenue(*conditions):
+        return func.coalesce(func.sum(Order.total).filter(not_cancelled, *conditions), 0)
+
+    def customers(condition=None):
+        distinct_phones = func.count(func.distinct(Order.customer_phone))
+        return distinct_phones if condition is None else distinct_phones.filter(condition)
+
+    kpis = db.session.query(
+        revenue().label('total_revenue'),
+        revenue(today).label('today_revenue'),
+        revenue(this_month).label('this_month_revenue'),
+        revenue(last_month).label('last_month_revenue'),
+        func.count(Order.id).label('total_orders'),
+        func.count(Order.id).filter(today).label('today_orders'),
+        func.count(Order.id).filter(this_month).label('this_month_orders'),
+        func.count(Order.id).filter(last_month).label('last_month_orders'),
+        *[func.count(Order.id).filter(Order.status == s).label(s) for s in STATUSES],
+        customers().label('total_customers'),
+        customers(this_month).label('this_month_customers'),
+        customers(last_month).label('last_month_customers'),
+    ).one()
+    products = db.session.query(
+        func.count(Product.id),
+        func.count(Product.id).filter(Product.in_stock == True),
+        func.count(Product.id).filter(Product.in_stock == False),
+        func.count(Product.id).filter(Product.is_new == True),
+        func.count(Product.id).filter(Product.is_sale == True),
+    ).one()
+
+    result = kpis._asdict()
+    counts = {s: result.pop(s) for s in STATUSES}
+    result['status_counts'] = {s: n for s, n in counts.items() if n}  # GROUP BY omits empty statuses
+    result['pending'] = result['status_counts'].get('pending', 0)
+    result['products'] = list(products)
+    return result
+
+
+# ==================== TIMING ====================
+
+def timed(run, repeat):
+    """Milliseconds for each of `repeat` runs, after one warm-up run"""
+    run()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples, baseline=None):
+    median = statistics.median(samples)
+    speedup = f'{baseline / median:6.1f}x' if baseline else '      -'
+    print(f'{name:<10} {min(samples):10.1f} {median:10.1f} {speedup}')
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the dashboard stats queries on a seeded database')
+    parser.add_argument('--database-url', required=True, help='scratch database; it is wiped')
+    parser.add_argument('--orders', type=int, default=ORDERS)
+    parser.add_argument('--customers', type=int, default=CUSTOMERS, help='distinct customer phones')
+    parser.add_argument('--days', type=int, default=DAYS, help='days the orders are spread over')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the data from the last run')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url  # read by config.py on import
+    from flask_jwt_extended import create_access_token
+    from app import app
+    from models import db
+    from rollup import rebuild
+
+    with app.app_context():
+        if not args.skip_seed:
+            start = time.perf_counter()
+            seed(db, args.orders, args.customers, args.days)
+            print(f'Seeded {args.orders:,} orders in {time.perf_counter() - start:.1f}s')
+            start = time.perf_counter()
+            days = rebuild()
+            print(f'Built the rollup for {days} days in {time.perf_counter() - start:.1f}s')
+
+        legacy, new = legacy_stats(db), filter_stats(db)
+        assert legacy == new, f'legacy and filter KPIs differ:\n{legacy}\n{new}'
+
+        client = app.test_client()
+        headers = {'Authorization': f'Bearer {create_access_token(identity="1")}'}
+
+        def endpoint(query=''):
+            response = client.get(f'/api/admin/dashboard/stats{query}', headers=headers)
+            assert response.status_code == 200, response.get_data(as_text=True)
+
+        print(f'\n{"variant":<10} {"min ms":>10} {"median ms":>10} {"speedup":>7}')
+        baseline = report('legacy', timed(lambda: legacy_stats(db), args.repeat))
+        report('filter', timed(lambda: filter_stats(db), args.repeat), baseline)
+        report('endpoint', timed(endpoint, args.repeat), baseline)
+        report('exact', timed(lambda: endpoint('?exact=true'), args.repeat), baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,93 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
-from models import db, Gender, ProductType, Product
-from sqlalchemy import desc
+from models import db, Gender, ProductType, Product, ProductVariant, OrderItem, product_counts_by_type, product_hierarchy
+from sqlalchemy import desc, func
+from sqlalchemy.orm import joinedload
+from catalog_version import catalog_version
+from facets import facet_index
+from inventory import sync_in_stock
+from pagination import COUNT_MODES, count_cache_key, paginate
 
 crud_bp = Blueprint('crud', __name__, url_prefix='/api/admin')
 
+
+def normalize_slug(slug):
+    """Slugs are stored lowercase so public lookups are plain, indexable equality"""
+    return slug.strip().lower()
+
+
+# ==================== CATALOG CACHE NOTIFICATIONS ====================
+# Called after every successful commit below, so this worker's in-memory
+# catalog caches never serve data older than the admin's own write.
+
+def categories_changed():
+    catalog_version.bump()
+
+
+def product_saved(product):
+    facet_index.upsert_product(product, catalog_version.bump())
+
+
+def product_deleted(product_id):
+    facet_index.remove_product(product_id, catalog_version.bump())
+
+
+# ==================== PRODUCT VARIANTS ====================
+
+def apply_variants(product, variants):
+    """
+    Sync product.variants with a [{size, color, stock_quantity}] payload.
+    Rows are matched on size/color and updated in place; variants missing
+    from the payload are removed. Returns an error message or None.
+    """
+    existing = {(v.size, v.color): v for v in product.variants}
+    seen = set()
+    
+    for entry in variants:
+        key = ProductVariant.key(entry.get('size'), entry.get('color'))
+        stock = entry.get('stock_quantity', 0)
+        if not isinstance(stock, int) or isinstance(stock, bool) or stock < 0:
+            return f'Invalid stock_quantity for variant {key[0] or "-"}/{key[1] or "-"}'
+        if key in seen:
+            return f'Duplicate variant {key[0] or "-"}/{key[1] or "-"}'
+        seen.add(key)
+        
+        if key in existing:
+            existing[key].stock_quantity = stock
+        else:
+            product.variants.append(ProductVariant(size=key[0], color=key[1], stock_quantity=stock))
+    
+    for key, variant in existing.items():
+        if key not in seen:
+            product.variants.remove(variant)
+    return None
+
+
+def format_variant(variant):
+    return {
+        'id': variant.id,
+        'size': variant.size,
+        'color': variant.color,
+        'stock_quantity': variant.stock_quantity
+    }
+
+
 # ==================== GENDERS (TOP LEVEL: Men, Women) ====================
 @crud_bp.route('/genders', methods=['GET'])
 @jwt_required()
 def get_genders():
     """Get all top-level genders (Men, Women)"""
     genders = Gender.query.all()
+    type_counts = dict(
+        db.session.query(ProductType.gender_id, func.count(ProductType.id))
+        .group_by(ProductType.gender_id)
+        .all()
+    )
     return jsonify([{
         'id': g.id,
         'name': g.name,
         'slug': g.slug,
-        'product_types_count': len(g.product_types)
+        'product_types_count': type_counts.get(g.id, 0)
     } for g in genders]), 200
 
 @crud_bp.route('/genders/<int:id>', methods=['GET'])
@@ -39,6 +111,8 @@ def get_gender(id):
 def create_gender():
     """Create a new top-level Gender (e.g., Kids)"""
     data = request.get_json()
+    if data.get('slug'):
+        data['slug'] = normalize_slug(data['slug'])
     
     if not data.get('name') or not data.get('slug'):
         return jsonify({'error': 'Name and slug are required'}), 400
@@ -49,6 +123,7 @@ def create_gender():
     gender = Gender(name=data['name'], slug=data['slug'])
     db.session.add(gender)
     db.session.commit()
+    categories_changed()
     
     return jsonify({'message': 'Created', 'id': gender.id}), 201
 
@@ -58,6 +133,8 @@ def update_gender(id):
     """Update a top-level Gender"""
     gender = Gender.query.get_or_404(id)
     data = request.get_json()
+    if data.get('slug'):
+        data['slug'] = normalize_slug(data['slug'])
     
     if 'name' in data:
         gender.name = data['name']
@@ -68,6 +145,7 @@ def update_gender(id):
         gender.slug = data['slug']
     
     db.session.commit()
+    categories_changed()
     return jsonify({'message': 'Updated'}), 200
 
 @crud_bp.route('/genders/<int:id>', methods=['DELETE'])
@@ -76,11 +154,12 @@ def delete_gender(id):
     """Delete a top-level Gender"""
     gender = Gender.query.get_or_404(id)
     
-    if gender.product_types:
+    if db.session.query(ProductType.query.filter_by(gender_id=id).exists()).scalar():
         return jsonify({'error': 'Has product types'}), 400
     
     db.session.delete(gender)
     db.session.commit()
+    categories_changed()
     return jsonify({'message': 'Deleted'}), 200
 
 # ==================== PRODUCT TYPES (SECOND LEVEL: T-Shirts, Jeans) ====================
@@ -88,13 +167,14 @@ def delete_gender(id):
 @jwt_required()
 def get_product_types():
     """Get all Product Types (T-Shirt, Jeans)"""
-    types = ProductType.query.all()
+    types = ProductType.query.options(joinedload(ProductType.gender)).all()
+    counts = product_counts_by_type()
     return jsonify([{
         'id': pt.id,
         'name': pt.name,
         'slug': pt.slug,
         'gender': {'id': pt.gender.id, 'name': pt.gender.name},
-        'products_count': len(pt.products)
+        'products_count': counts.get(pt.id, 0)
     } for pt in types]), 200
 
 @crud_bp.route('/product-types/<int:id>', methods=['GET'])
@@ -115,6 +195,8 @@ def get_product_type(id):
 def create_product_type():
     """Create a new Product Type"""
     data = request.get_json()
+    if data.get('slug'):
+        data['slug'] = normalize_slug(data['slug'])
     
     if not all(data.get(f) for f in ['name', 'gender_id']):
         return jsonify({'error': 'Missing required fields'}), 400
@@ -156,6 +238,7 @@ def create_product_type():
     )
     db.session.add(product_type)
     db.session.commit()
+    categories_changed()
     
     return jsonify({'message': 'Created', 'id': product_type.id}), 201
 
@@ -165,6 +248,8 @@ def update_product_type(id):
     """Update a Product Type"""
     product_type = ProductType.query.get_or_404(id)
     data = request.get_json()
+    if data.get('slug'):
+        data['slug'] = normalize_slug(data['slug'])
     
     if 'name' in data:
         # Check if new name conflicts with existing product type in same gender
@@ -210,6 +295,7 @@ def update_product_type(id):
             product_type.slug = f"{gender.slug}-{product_type.name.lower().replace(' ', '-')}"
     
     db.session.commit()
+    categories_changed()
     return jsonify({'message': 'Updated'}), 200
 
 @crud_bp.route('/product-types/<int:id>', methods=['DELETE'])
@@ -218,11 +304,12 @@ def delete_product_type(id):
     """Delete a Product Type"""
     product_type = ProductType.query.get_or_404(id)
     
-    if product_type.products:
+    if db.session.query(Product.query.filter_by(product_type_id=id).exists()).scalar():
         return jsonify({'error': 'Has products'}), 400
     
     db.session.delete(product_type)
     db.session.commit()
+    categories_changed()
     return jsonify({'message': 'Deleted'}), 200
 
 # ==================== PRODUCTS ====================
@@ -232,8 +319,11 @@ def get_products():
     """Get all products with pagination and filters"""
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
+    count = request.args.get('count', 'exact')
+    if count not in COUNT_MODES:
+        return jsonify({'error': 'Invalid count mode'}), 400
     
-    query = Product.query
+    query = Product.query.options(product_hierarchy())
     
     if request.args.get('product_type_id'):
         query = query.filter_by(product_type_id=request.args.get('product_type_id'))
@@ -242,8 +332,9 @@ def get_products():
     if request.args.get('is_sale') is not None:
         query = query.filter_by(is_sale=request.args.get('is_sale').lower() == 'true')
     
-    pagination = query.order_by(desc(Product.created_at)).paginate(
-        page=page, per_page=per_page, error_out=False
+    pagination = paginate(
+        query.order_by(desc(Product.created_at)), page, per_page,
+        count=count, cache_key=count_cache_key('admin.products', request.args)
     )
     
     return jsonify({
@@ -261,6 +352,7 @@ def get_products():
         } for p in pagination.items],
         'total': pagination.total,
         'pages': pagination.pages,
+        'has_next': pagination.has_next,
         'current_page': page
     }), 200
 
@@ -284,6 +376,7 @@ def get_product(id):
         'sales_count': p.sales_count,
         'review_count': p.review_count,
         'product_type_id': p.product_type_id,
+        'variants': [format_variant(v) for v in p.variants],
         'created_at': p.created_at.isoformat() if p.created_at else None
     }), 200
 
@@ -316,8 +409,15 @@ def create_product():
         product_type_id=data['product_type_id']
     )
     
+    error = apply_variants(product, data.get('variants', []))
+    if error:
+        return jsonify({'error': error}), 400
+    
     db.session.add(product)
+    db.session.flush()
+    sync_in_stock([product.id])
     db.session.commit()
+    product_saved(product)
     
     return jsonify({'message': 'Created', 'id': product.id}), 201
 
@@ -340,7 +440,16 @@ def update_product(id):
             return jsonify({'error': 'Product type not found'}), 404
         product.product_type_id = data['product_type_id']
     
+    if 'variants' in data:
+        error = apply_variants(product, data['variants'])
+        if error:
+            db.session.rollback()
+            return jsonify({'error': error}), 400
+        db.session.flush()
+        sync_in_stock([product.id])
+    
     db.session.commit()
+    product_saved(product)
     return jsonify({'message': 'Updated'}), 200
 
 @crud_bp.route('/products/<int:id>', methods=['DELETE'])
@@ -349,9 +458,10 @@ def delete_product(id):
     """Delete a product"""
     product = Product.query.get_or_404(id)
     
-    if product.order_items:
+    if db.session.query(OrderItem.query.filter_by(product_id=id).exists()).scalar():
         return jsonify({'error': 'Has existing orders'}), 400
     
     db.session.delete(product)
     db.session.commit()
+    product_deleted(id)
     return jsonify({'message': 'Deleted'}), 200
\ No newline at end of file
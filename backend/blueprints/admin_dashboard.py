@@ -1,7 +1,10 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required
-from models import db, Gender, ProductType, Product, Order, OrderItem
-from sqlalchemy import func, desc, cast, Date
+from models import db, DailyProductSales, DailySales, Gender, ProductType, Product, Order, product_hierarchy
+from sqlalchemy import and_, func, desc, cast, literal_column, Date
+from blueprints.admin_orders import ORDER_STATUSES
+from hll import STANDARD_ERROR
+from rollup import distinct_customers
 from datetime import datetime, timedelta
 import pytz
 
@@ -22,128 +25,99 @@ def get_dashboard_stats():
     """
     Master stats endpoint — returns all KPI cards in one shot.
     Covers: revenue, orders, products, customers (unique phones).
+    Revenue and order counts come from the daily_sales rollup (one row
+    per day and status). Customer counts merge HyperLogLog sketches and
+    are approximate (see `error_pct`); pass exact=true to count distinct
+    phones on the orders table instead.
     """
     now = get_lebanon_now()
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     last_month_start = (today_start.replace(day=1) - timedelta(days=1)).replace(day=1)
     this_month_start = today_start.replace(day=1)
 
-    # ── Revenue ────────────────────────────────────────────────
-    total_revenue = db.session.query(
-        func.coalesce(func.sum(Order.total), 0)
-    ).filter(Order.status != 'cancelled').scalar()
-
-    today_revenue = db.session.query(
-        func.coalesce(func.sum(Order.total), 0)
-    ).filter(
-        Order.status != 'cancelled',
-        Order.created_at >= today_start
-    ).scalar()
-
-    this_month_revenue = db.session.query(
-        func.coalesce(func.sum(Order.total), 0)
-    ).filter(
-        Order.status != 'cancelled',
-        Order.created_at >= this_month_start
-    ).scalar()
-
-    last_month_revenue = db.session.query(
-        func.coalesce(func.sum(Order.total), 0)
-    ).filter(
-        Order.status != 'cancelled',
-        Order.created_at >= last_month_start,
-        Order.created_at < this_month_start
-    ).scalar()
-
-    revenue_change = _pct_change(float(last_month_revenue), float(this_month_revenue))
-
-    # ── Orders ─────────────────────────────────────────────────
-    total_orders = Order.query.count()
-
-    today_orders = Order.query.filter(
-        Order.created_at >= today_start
-    ).count()
-
-    pending_orders = Order.query.filter_by(status='pending').count()
-
-    this_month_orders = Order.query.filter(
-        Order.created_at >= this_month_start
-    ).count()
-
-    last_month_orders = Order.query.filter(
-        Order.created_at >= last_month_start,
-        Order.created_at < this_month_start
-    ).count()
-
-    orders_change = _pct_change(last_month_orders, this_month_orders)
-
-    # Status breakdown
-    status_counts = dict(
-        db.session.query(Order.status, func.count(Order.id))
-        .group_by(Order.status)
-        .all()
-    )
+    today = DailySales.day >= today_start.date()
+    this_month = DailySales.day >= this_month_start.date()
+    last_month = and_(DailySales.day >= last_month_start.date(), DailySales.day < this_month_start.date())
+
+    def revenue(*conditions):
+        return func.coalesce(func.sum(DailySales.revenue).filter(DailySales.status != 'cancelled', *conditions), 0)
+
+    def orders(*conditions):
+        total = func.sum(DailySales.orders)
+        return func.coalesce(total.filter(*conditions) if conditions else total, 0)
+
+    # ── Revenue and orders: one pass over the daily rollup ────
+    kpis = db.session.query(
+        revenue().label('total_revenue'),
+        revenue(today).label('today_revenue'),
+        revenue(this_month).label('this_month_revenue'),
+        revenue(last_month).label('last_month_revenue'),
+        orders().label('total_orders'),
+        orders(today).label('today_orders'),
+        orders(this_month).label('this_month_orders'),
+        orders(last_month).label('last_month_orders'),
+        *[orders(DailySales.status == s).label(s) for s in ORDER_STATUSES],
+    ).one()
+
+    # ── Customers (unique phones) ──────────────────────────────
+    exact_customers = request.args.get('exact') == 'true'
+    if exact_customers:
+        def customers(condition=None):
+            distinct_phones = func.count(func.distinct(Order.customer_phone))
+            return distinct_phones if condition is None else distinct_phones.filter(condition)
+
+        customer_kpis = db.session.query(
+            customers().label('total'),
+            customers(Order.created_at >= this_month_start).label('this_month'),
+            customers(and_(Order.created_at >= last_month_start, Order.created_at < this_month_start)).label('last_month'),
+        ).one()
+        total_customers, this_month_customers, last_month_customers = customer_kpis
+    else:
+        total_customers = distinct_customers()
+        this_month_customers = distinct_customers(this_month_start.date(), today_start.date())
+        last_month_customers = distinct_customers(last_month_start.date(), this_month_start.date() - timedelta(days=1))
+
+    revenue_change = _pct_change(float(kpis.last_month_revenue), float(kpis.this_month_revenue))
+    orders_change = _pct_change(kpis.last_month_orders, kpis.this_month_orders)
+    customers_change = _pct_change(last_month_customers, this_month_customers)
 
-    # ── Products ───────────────────────────────────────────────
-    total_products = Product.query.count()
-    in_stock_count = Product.query.filter_by(in_stock=True).count()
-    out_of_stock_count = Product.query.filter_by(in_stock=False).count()
-    new_arrivals = Product.query.filter_by(is_new=True).count()
-    on_sale = Product.query.filter_by(is_sale=True).count()
+    # ── Products: one pass over products ──────────────────────
+    product_kpis = db.session.query(
+        func.count(Product.id).label('total'),
+        func.count(Product.id).filter(Product.in_stock == True).label('in_stock'),
+        func.count(Product.id).filter(Product.in_stock == False).label('out_of_stock'),
+        func.count(Product.id).filter(Product.is_new == True).label('new_arrivals'),
+        func.count(Product.id).filter(Product.is_sale == True).label('on_sale'),
+    ).one()
 
     # Critical: out of stock items (list)
-    out_of_stock_items = Product.query.filter_by(in_stock=False).order_by(
+    out_of_stock_items = Product.query.options(product_hierarchy()).filter_by(in_stock=False).order_by(
         desc(Product.sales_count)
     ).limit(5).all()
 
-    # ── Customers (unique phones) ──────────────────────────────
-    total_customers = db.session.query(
-        func.count(func.distinct(Order.customer_phone))
-    ).scalar()
-
-    this_month_customers = db.session.query(
-        func.count(func.distinct(Order.customer_phone))
-    ).filter(Order.created_at >= this_month_start).scalar()
-
-    last_month_customers = db.session.query(
-        func.count(func.distinct(Order.customer_phone))
-    ).filter(
-        Order.created_at >= last_month_start,
-        Order.created_at < this_month_start
-    ).scalar()
-
-    customers_change = _pct_change(last_month_customers, this_month_customers)
-
     return jsonify({
         'revenue': {
-            'total': float(total_revenue),
-            'today': float(today_revenue),
-            'this_month': float(this_month_revenue),
-            'last_month': float(last_month_revenue),
+            'total': float(kpis.total_revenue),
+            'today': float(kpis.today_revenue),
+            'this_month': float(kpis.this_month_revenue),
+            'last_month': float(kpis.last_month_revenue),
             'change_pct': revenue_change,
         },
         'orders': {
-            'total': total_orders,
-            'today': today_orders,
-            'pending': pending_orders,
-            'this_month': this_month_orders,
-            'last_month': last_month_orders,
+            'total': kpis.total_orders,
+            'today': kpis.today_orders,
+            'pending': kpis.pending,
+            'this_month': kpis.this_month_orders,
+            'last_month': kpis.last_month_orders,
             'change_pct': orders_change,
-            'status_counts': {
-                'pending':    status_counts.get('pending', 0),
-                'confirmed':  status_counts.get('confirmed', 0),
-                'processing': status_counts.get('processing', 0),
-                'shipped':    status_counts.get('shipped', 0),
-                'delivered':  status_counts.get('delivered', 0),
-                'cancelled':  status_counts.get('cancelled', 0),
-            },
+            'status_counts': {s: getattr(kpis, s) for s in ORDER_STATUSES},
         },
         'products': {
-            'total': total_products,
-            'in_stock': in_stock_count,
-            'out_of_stock': out_of_stock_count,
-            'new_arrivals': new_arrivals,
-            'on_sale': on_sale,
+            'total': product_kpis.total,
+            'in_stock': product_kpis.in_stock,
+            'out_of_stock': product_kpis.out_of_stock,
+            'new_arrivals': product_kpis.new_arrivals,
+            'on_sale': product_kpis.on_sale,
             'critical_stock': [{
                 'id': p.id,
                 'title': p.title,
@@ -156,59 +130,98 @@ def get_dashboard_stats():
             'this_month': this_month_customers,
             'last_month': last_month_customers,
             'change_pct': customers_change,
+            'approximate': not exact_customers,
+            # Relative standard error of each count; ~95% fall within twice this
+            'error_pct': None if exact_customers else round(STANDARD_ERROR * 100, 2),
         },
     }), 200
 
 
 # ==================== REVENUE CHART (12-MONTH TREND) ====================
 
+CHART_GRANULARITIES = ('day', 'week', 'month')
+MAX_CHART_MONTHS = 36
+
+
 @dashboard_bp.route('/dashboard/revenue-chart', methods=['GET'])
 @jwt_required()
 def get_revenue_chart():
     """
-    Returns monthly revenue for the last 12 months.
+    Returns revenue and order counts per bucket, oldest first.
     Used to power the sparkline/bar chart on the dashboard.
+    Query params:
+    - months: how many calendar months back, including this one (default 12)
+    - granularity: day, week or month (default)
+    One grouped query over the daily_sales rollup regardless of the number
+    of buckets; empty buckets are filled with zeros.
     """
+    months = request.args.get('months', 12, type=int)
+    months = max(1, min(months, MAX_CHART_MONTHS))
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in CHART_GRANULARITIES:
+        return jsonify({'error': 'Invalid granularity'}), 400
+
     now = get_lebanon_now()
-    months = []
-
-    for i in range(11, -1, -1):
-        # First day of each of the last 12 months
-        target = (now.replace(day=1) - timedelta(days=1)).replace(day=1) if i > 0 else now.replace(day=1)
-        # Walk back i months properly
-        month = now.month - i
-        year = now.year
-        while month <= 0:
-            month += 12
-            year -= 1
-        first_day = now.replace(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0)
-        if month == 12:
-            last_day = first_day.replace(year=year + 1, month=1, day=1)
-        else:
-            last_day = first_day.replace(month=month + 1, day=1)
-
-        revenue = db.session.query(
-            func.coalesce(func.sum(Order.total), 0)
-        ).filter(
-            Order.status != 'cancelled',
-            Order.created_at >= first_day,
-            Order.created_at < last_day
-        ).scalar()
-
-        orders_count = Order.query.filter(
-            Order.created_at >= first_day,
-            Order.created_at < last_day
-        ).count()
-
-        months.append({
-            'month': first_day.strftime('%b'),
-            'year': first_day.year,
-            'label': first_day.strftime('%b %Y'),
-            'revenue': float(revenue),
-            'orders': orders_count,
+    first_day = _add_months(now.date().replace(day=1), -(months - 1))
+
+    # Rollup days are already Beirut-local. The unit is literal SQL (it is
+    # whitelisted above) so the SELECT and GROUP BY expressions are
+    # identical; bound parameters would differ.
+    bucket = func.date_trunc(literal_column(f"'{granularity}'"), DailySales.day).label('bucket')
+
+    rows = (
+        db.session.query(
+            bucket,
+            func.coalesce(func.sum(DailySales.revenue).filter(DailySales.status != 'cancelled'), 0).label('revenue'),
+            func.sum(DailySales.orders).label('orders'),
+        )
+        .filter(DailySales.day >= first_day)
+        .group_by(bucket)
+        .all()
+    )
+    totals = {r.bucket.date(): r for r in rows}
+
+    chart = []
+    for start in _chart_buckets(first_day, now.date(), granularity):
+        row = totals.get(start)
+        chart.append({
+            'month': start.strftime('%b'),
+            'year': start.year,
+            'date': start.isoformat(),
+            'label': _bucket_label(start, granularity),
+            'revenue': float(row.revenue) if row else 0.0,
+            'orders': int(row.orders) if row else 0,
         })
 
-    return jsonify({'chart': months}), 200
+    return jsonify({'chart': chart, 'months': months, 'granularity': granularity}), 200
+
+
+def _add_months(day, months):
+    """First-of-month `day` moved by `months` calendar months"""
+    index = day.year * 12 + day.month - 1 + months
+    return day.replace(year=index // 12, month=index % 12 + 1)
+
+
+def _chart_buckets(first_day, last_day, granularity):
+    """Start dates of every bucket from first_day to last_day, as date_trunc gives them"""
+    if granularity == 'month':
+        start, step = first_day, lambda d: _add_months(d, 1)
+    elif granularity == 'week':
+        start, step = first_day - timedelta(days=first_day.weekday()), lambda d: d + timedelta(weeks=1)  # ISO weeks start Monday
+    else:
+        start, step = first_day, lambda d: d + timedelta(days=1)
+
+    while start <= last_day:
+        yield start
+        start = step(start)
+
+
+def _bucket_label(start, granularity):
+    if granularity == 'month':
+        return start.strftime('%b %Y')
+    if granularity == 'week':
+        return f"Week of {start.strftime('%d %b %Y')}"
+    return start.strftime('%d %b %Y')
 
 
 # ==================== TOP PRODUCTS ====================
@@ -217,29 +230,47 @@ def get_revenue_chart():
 @jwt_required()
 def get_top_products():
     """
-    Returns top 5 products by sales_count.
-    Joins ProductType for context. Mirrors the TopProducts widget.
+    Returns top 5 products by units sold (cancelled orders excluded),
+    from the daily_product_sales rollup. Mirrors the TopProducts widget.
     """
-    products = Product.query.order_by(
-        desc(Product.sales_count)
-    ).limit(5).all()
-
-    # Total revenue per product = price * sales_count (approximation)
-    return jsonify({
-        'top_products': [{
+    units = func.sum(DailyProductSales.units)
+    top = (
+        db.session.query(
+            DailyProductSales.product_id,
+            units.label('units_sold'),
+            func.sum(DailyProductSales.revenue).label('revenue'),
+        )
+        .filter(DailyProductSales.status != 'cancelled')
+        .group_by(DailyProductSales.product_id)
+        .order_by(desc(units))
+        .limit(5)
+        .all()
+    )
+    products = {
+        p.id: p for p in Product.query.options(product_hierarchy())
+        .filter(Product.id.in_([r.product_id for r in top]))
+    }
+
+    top_products = []
+    for r in top:
+        p = products.get(r.product_id)
+        if p is None:
+            continue  # deleted since the rollup was refreshed
+        top_products.append({
             'id': p.id,
             'title': p.title,
             'product_type': p.product_type.name,
             'gender': p.product_type.gender.name,
-            'sales_count': p.sales_count,
-            'revenue': float(p.price) * p.sales_count,
+            'sales_count': int(r.units_sold),
+            'revenue': float(r.revenue),
             'price': float(p.price),
             'in_stock': p.in_stock,
             'is_new': p.is_new,
             'is_sale': p.is_sale,
             'images': p.images,
-        } for p in products]
-    }), 200
+        })
+
+    return jsonify({'top_products': top_products}), 200
 
 
 # ==================== GENDER BREAKDOWN ====================
@@ -249,15 +280,14 @@ def get_top_products():
 def get_gender_breakdown():
     """
     Returns sales count per Gender (Men, Women, Kids, Unisex).
-    Walks: OrderItem → Product → ProductType → Gender.
+    Walks: DailyProductSales → Product → ProductType → Gender.
     """
     rows = (
-        db.session.query(Gender.name, func.sum(OrderItem.quantity).label('units_sold'))
+        db.session.query(Gender.name, func.sum(DailyProductSales.units).label('units_sold'))
         .join(ProductType, ProductType.gender_id == Gender.id)
         .join(Product, Product.product_type_id == ProductType.id)
-        .join(OrderItem, OrderItem.product_id == Product.id)
-        .join(Order, Order.id == OrderItem.order_id)
-        .filter(Order.status != 'cancelled')
+        .join(DailyProductSales, DailyProductSales.product_id == Product.id)
+        .filter(DailyProductSales.status != 'cancelled')
         .group_by(Gender.name)
         .all()
     )
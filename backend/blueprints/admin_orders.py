@@ -1,63 +1,161 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required
-from models import db, Order, OrderItem, Product
-from sqlalchemy import desc, or_, func
-from datetime import datetime
+from models import db, Order, OrderItem, Product, lebanon_tz
+from sqlalchemy import delete, desc, or_, func, select, update
+from sqlalchemy.orm import load_only, selectinload
+from datetime import datetime, timedelta
+from itertools import groupby
+import csv
+import io
+import json
+import re
+from inventory import InsufficientStock, release_stock, retake_stock
+from pagination import COUNT_MODES, InvalidCursor, count_cache_key, keyset_paginate, paginate
+from serializers import column_field, columns_for, isoformat_or_none, parse_fields, render
+from rollup import orders_changed
 
 admin_orders_bp = Blueprint('admin_orders', __name__, url_prefix='/api/admin/orders')
 
+ORDER_STATUSES = ['pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']
+PAYMENT_STATUSES = ['pending', 'paid', 'failed', 'refunded']
+
+# ==================== SERIALIZERS ====================
+
+# Admin views of an order (see serializers.py); `?fields=` limits both the
+# loaded columns and the JSON keys.
+ORDER_LIST_FIELDS = {
+    'id': column_field(Order.id),
+    'order_number': column_field(Order.order_number),
+    'customer_name': column_field(Order.customer_name),
+    'customer_phone': column_field(Order.customer_phone),
+    'city': column_field(Order.city),
+    'total': column_field(Order.total, str),
+    'status': column_field(Order.status),
+    'payment_status': column_field(Order.payment_status),
+    'item_count': column_field(Order.item_count),
+    'created_at': column_field(Order.created_at, isoformat_or_none),
+    'delivered_at': column_field(Order.delivered_at, isoformat_or_none),
+}
+
+ORDER_DETAIL_FIELDS = {
+    'id': column_field(Order.id),
+    'order_number': column_field(Order.order_number),
+    'customer_name': column_field(Order.customer_name),
+    'customer_phone': column_field(Order.customer_phone),
+    'address_line1': column_field(Order.address_line1),
+    'city': column_field(Order.city),
+    'latitude': column_field(Order.latitude),
+    'longitude': column_field(Order.longitude),
+    'subtotal': column_field(Order.subtotal, str),
+    'shipping_cost': column_field(Order.shipping_cost, str),
+    'total': column_field(Order.total, str),
+    'status': column_field(Order.status),
+    'payment_status': column_field(Order.payment_status),
+    'created_at': column_field(Order.created_at, isoformat_or_none),
+    'updated_at': column_field(Order.updated_at, isoformat_or_none),
+    'delivered_at': column_field(Order.delivered_at, isoformat_or_none),
+    'items': ((), lambda o: [{
+        'id': item.id,
+        'product_id': item.product_id,
+        'product_title': item.product_title,
+        'product_image': item.product_image,
+        'price': str(item.price),
+        'size': item.size,
+        'color': item.color,
+        'quantity': item.quantity,
+        'subtotal': str(item.subtotal)
+    } for item in o.order_items]),
+}
+
 # ==================== ORDERS LIST & STATS ====================
 @admin_orders_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_orders():
-    """Get all orders with filtering and pagination"""
+    """
+    Get all orders with filtering and pagination
+    Query params:
+    - status, payment_status: exact filters
+    - search: order number, customer name, city or phone digits
+    - page/per_page/count: offset pages (default)
+    - cursor/limit: keyset pages on (created_at, id); returns next_cursor
+    - fields: comma-separated order keys to return (default: all)
+    """
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
-    
-    query = Order.query
-    
-    # Apply filters
-    if request.args.get('status'):
-        query = query.filter_by(status=request.args.get('status'))
-    
-    if request.args.get('payment_status'):
-        query = query.filter_by(payment_status=request.args.get('payment_status'))
-    
-    if request.args.get('search'):
-        search_term = f'%{request.args.get("search")}%'
-        query = query.filter(
-            or_(
-                Order.order_number.ilike(search_term),
-                Order.customer_name.ilike(search_term),
-                Order.customer_phone.ilike(search_term),
-                Order.city.ilike(search_term)
+    count = request.args.get('count', 'exact')
+    if count not in COUNT_MODES:
+        return jsonify({'error': 'Invalid count mode'}), 400
+    
+    try:
+        fields = parse_fields(request.args.get('fields'), ORDER_LIST_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    query = Order.query.options(load_only(*columns_for(ORDER_LIST_FIELDS, fields, Order.id, Order.created_at)))
+    query = filter_orders(query, request.args)
+    
+    # Cursor mode: constant cost per page however deep the admin scrolls
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+    if cursor is not None or limit is not None:
+        try:
+            orders, next_cursor = keyset_paginate(
+                query, 'created_at', Order.created_at, Order.id, True,
+                cursor=cursor, limit=limit
             )
-        )
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'orders': [render(o, ORDER_LIST_FIELDS, fields) for o in orders],
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }), 200
     
     # Order by newest first
-    pagination = query.order_by(desc(Order.created_at)).paginate(
-        page=page, per_page=per_page, error_out=False
+    pagination = paginate(
+        query.order_by(desc(Order.created_at), desc(Order.id)), page, per_page,
+        count=count, cache_key=count_cache_key('admin.orders', request.args)
     )
     
     return jsonify({
-        'orders': [{
-            'id': o.id,
-            'order_number': o.order_number,
-            'customer_name': o.customer_name,
-            'customer_phone': o.customer_phone,
-            'city': o.city,
-            'total': str(o.total),
-            'status': o.status,
-            'payment_status': o.payment_status,
-            'item_count': o.item_count,
-            'created_at': o.created_at.isoformat() if o.created_at else None,
-            'delivered_at': o.delivered_at.isoformat() if o.delivered_at else None
-        } for o in pagination.items],
+        'orders': [render(o, ORDER_LIST_FIELDS, fields) for o in pagination.items],
         'total': pagination.total,
         'pages': pagination.pages,
+        'has_next': pagination.has_next,
         'current_page': page
     }), 200
 
+PHONE_SEARCH = re.compile(r'^[\d\s+()-]+$')
+
+def filter_orders(query, args):
+    """Apply the admin list filters (status, payment_status, search) from `args`"""
+    if args.get('status'):
+        query = query.filter_by(status=args.get('status'))
+    
+    if args.get('payment_status'):
+        query = query.filter_by(payment_status=args.get('payment_status'))
+    
+    if args.get('search'):
+        search = args.get('search').strip()
+        search_term = f'%{search}%'
+        # Each predicate has a trigram index, so the OR is a bitmap index scan
+        conditions = [
+            Order.order_number.ilike(search_term),
+            Order.customer_name.ilike(search_term),
+            Order.city.ilike(search_term)
+        ]
+        # A term that looks like a phone number is matched on its digits,
+        # ignoring spaces, dashes and +; anything else matches the phone as typed
+        digits = re.sub(r'\D', '', search)
+        if PHONE_SEARCH.match(search) and len(digits) >= 3:
+            conditions.append(Order.customer_phone_digits.like(f'%{digits}%'))
+        else:
+            conditions.append(Order.customer_phone.ilike(search_term))
+        query = query.filter(or_(*conditions))
+    
+    return query
+
 @admin_orders_bp.route('/stats', methods=['GET'])
 @jwt_required()
 def get_order_stats():
@@ -92,66 +190,186 @@ def get_order_stats():
         'total_orders': Order.query.count()
     }), 200
 
+# ==================== EXPORT ====================
+
+EXPORT_BATCH_SIZE = 1000  # rows fetched per round trip from the server-side cursor
+
+EXPORT_ORDER_COLUMNS = [
+    Order.id, Order.order_number, Order.created_at, Order.customer_name, Order.customer_phone,
+    Order.address_line1, Order.city, Order.latitude, Order.longitude, Order.subtotal,
+    Order.shipping_cost, Order.total, Order.item_count, Order.status, Order.payment_status,
+    Order.delivered_at,
+]
+
+EXPORT_ITEM_COLUMNS = [
+    OrderItem.id.label('item_id'), OrderItem.product_id, OrderItem.product_title,
+    OrderItem.size, OrderItem.color, OrderItem.price.label('item_price'),
+    OrderItem.quantity, OrderItem.subtotal.label('item_subtotal'),
+]
+
+ORDER_KEYS = [c.key for c in EXPORT_ORDER_COLUMNS]
+ITEM_KEYS = [c.key for c in EXPORT_ITEM_COLUMNS]
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)  # Decimal money amounts, as in the other admin views
+
+
+# Spreadsheet apps run cells starting with these as formulas; customer
+# fields come from unauthenticated checkouts, so CSV cells are escaped
+FORMULA_PREFIXES = ('=', '@', '\t', '\r')
+PLAIN_NUMBER = re.compile(r'^[+-]?\d+(\.\d+)?$')
+
+
+def _csv_value(value):
+    """_export_value, with formula-like text prefixed by ' so it stays text"""
+    value = _export_value(value)
+    if not isinstance(value, str) or not value:
+        return value
+    if value.startswith(FORMULA_PREFIXES) or (
+        value[0] in '+-' and not (PLAIN_NUMBER.match(value) or PHONE_SEARCH.match(value))
+    ):
+        return "'" + value
+    return value
+
+
+def _parse_export_day(value, days=0):
+    """Start of the Beirut day YYYY-MM-DD (plus `days`), DST aware"""
+    return lebanon_tz.localize(datetime.strptime(value, '%Y-%m-%d') + timedelta(days=days))
+
+
+@admin_orders_bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_orders():
+    """
+    Stream every matching order with its items
+    Query params:
+    - format: csv (default; one row per item) or ndjson (one order per line)
+    - from, to: inclusive YYYY-MM-DD dates, Beirut time
+    - status, payment_status, search: same as the orders list
+    Rows come from a server-side cursor in batches, so memory stays flat
+    and the header goes out before the first batch is fetched.
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Invalid format'}), 400
+    
+    query = filter_orders(Order.query, request.args)
+    try:
+        if request.args.get('from'):
+            query = query.filter(Order.created_at >= _parse_export_day(request.args['from']))
+        if request.args.get('to'):
+            query = query.filter(Order.created_at < _parse_export_day(request.args['to'], days=1))
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    
+    query = (
+        query.outerjoin(Order.order_items)
+        .with_entities(*EXPORT_ORDER_COLUMNS, *EXPORT_ITEM_COLUMNS)
+        .order_by(Order.created_at, Order.id, OrderItem.id)
+        .yield_per(EXPORT_BATCH_SIZE)
+    )
+    
+    def export_rows():
+        # The view's session is torn down once the view returns, before the
+        # body streams; run on the streaming context's session so its
+        # teardown ends the transaction
+        return query.with_session(db.session())
+    
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(ORDER_KEYS + ITEM_KEYS)
+        yield buffer.getvalue()
+        
+        for row in export_rows():
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([_csv_value(v) for v in row])
+            yield buffer.getvalue()
+    
+    def generate_ndjson():
+        yield ''  # send the headers right away
+        # Rows are ordered by order, so each order's items are consecutive
+        for _, rows in groupby(export_rows(), key=lambda r: r.id):
+            rows = list(rows)
+            order = {key: _export_value(getattr(rows[0], key)) for key in ORDER_KEYS}
+            order['items'] = [
+                {key: _export_value(getattr(r, key)) for key in ITEM_KEYS}
+                for r in rows if r.item_id is not None
+            ]
+            yield json.dumps(order, ensure_ascii=False) + '\n'
+    
+    stamp = datetime.now(lebanon_tz).strftime('%Y%m%d-%H%M')
+    if export_format == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename=orders-{stamp}.{export_format}',
+            'X-Accel-Buffering': 'no',  # don't let a proxy hold the stream back
+        }
+    )
+
 # ==================== ORDER DETAILS ====================
 @admin_orders_bp.route('/<int:id>', methods=['GET'])
 @jwt_required()
 def get_order(id):
     """Get detailed order information"""
-    order = Order.query.get_or_404(id)
+    try:
+        fields = parse_fields(request.args.get('fields'), ORDER_DETAIL_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify({
-        'id': order.id,
-        'order_number': order.order_number,
-        'customer_name': order.customer_name,
-        'customer_phone': order.customer_phone,
-        'address_line1': order.address_line1,
-        'city': order.city,
-        'latitude': order.latitude,
-        'longitude': order.longitude,
-        'subtotal': str(order.subtotal),
-        'shipping_cost': str(order.shipping_cost),
-        'total': str(order.total),
-        'status': order.status,
-        'payment_status': order.payment_status,
-        'created_at': order.created_at.isoformat() if order.created_at else None,
-        'updated_at': order.updated_at.isoformat() if order.updated_at else None,
-        'delivered_at': order.delivered_at.isoformat() if order.delivered_at else None,
-        'items': [{
-            'id': item.id,
-            'product_id': item.product_id,
-            'product_title': item.product_title,
-            'product_image': item.product_image,
-            'price': str(item.price),
-            'size': item.size,
-            'color': item.color,
-            'quantity': item.quantity,
-            'subtotal': str(item.subtotal)
-        } for item in order.order_items]
-    }), 200
+    query = Order.query.options(load_only(*columns_for(ORDER_DETAIL_FIELDS, fields, Order.id)))
+    if fields is None or 'items' in fields:
+        query = query.options(selectinload(Order.order_items))
+    order = query.filter(Order.id == id).first_or_404()
+    
+    return jsonify(render(order, ORDER_DETAIL_FIELDS, fields)), 200
 
 # ==================== UPDATE ORDER STATUS ====================
 @admin_orders_bp.route('/<int:id>/status', methods=['PUT'])
 @jwt_required()
 def update_order_status(id):
     """Update order status"""
-    order = Order.query.get_or_404(id)
+    # Locked so two status changes can't both release (or retake) its stock
+    order = Order.query.filter_by(id=id).with_for_update().first_or_404()
     data = request.get_json()
     
     if not data.get('status'):
         return jsonify({'error': 'Status is required'}), 400
     
-    valid_statuses = ['pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']
     new_status = data['status']
     
-    if new_status not in valid_statuses:
+    if new_status not in ORDER_STATUSES:
         return jsonify({'error': 'Invalid status'}), 400
     
+    # Cancelling returns the order's stock; un-cancelling takes it back
+    try:
+        if new_status == 'cancelled' and order.status != 'cancelled':
+            release_stock([order.id])
+        elif order.status == 'cancelled' and new_status != 'cancelled':
+            retake_stock([order.id])
+    except InsufficientStock:
+        db.session.rollback()
+        return jsonify({'error': 'Not enough stock left to restore this order'}), 400
+    
     order.status = new_status
     
-    # Auto-set delivered timestamp
+    # Auto-set delivered timestamp (database clock, like bulk-status)
     if new_status == 'delivered' and not order.delivered_at:
-        order.delivered_at = datetime.now()
+        order.delivered_at = func.now()
     
+    db.session.add_all(orders_changed([order]))
     db.session.commit()
     
     return jsonify({
@@ -170,10 +388,9 @@ def update_payment_status(id):
     if not data.get('payment_status'):
         return jsonify({'error': 'Payment status is required'}), 400
     
-    valid_payment_statuses = ['pending', 'paid', 'failed', 'refunded']
     new_payment_status = data['payment_status']
     
-    if new_payment_status not in valid_payment_statuses:
+    if new_payment_status not in PAYMENT_STATUSES:
         return jsonify({'error': 'Invalid payment status'}), 400
     
     order.payment_status = new_payment_status
@@ -206,6 +423,10 @@ def update_order(id):
     if 'shipping_cost' in data:
         order.total = order.subtotal + data['shipping_cost']
     
+    # Totals feed the sales rollup and phones the customer sketches
+    if 'shipping_cost' in data or 'customer_phone' in data:
+        db.session.add_all(orders_changed([order]))
+    
     db.session.commit()
     
     return jsonify({'message': 'Order updated'}), 200
@@ -215,7 +436,7 @@ def update_order(id):
 @jwt_required()
 def delete_order(id):
     """Delete an order (use with caution)"""
-    order = Order.query.get_or_404(id)
+    order = Order.query.filter_by(id=id).with_for_update().first_or_404()
     
     # Prevent deletion of delivered or paid orders
     if order.status == 'delivered':
@@ -224,39 +445,159 @@ def delete_order(id):
     if order.payment_status == 'paid':
         return jsonify({'error': 'Cannot delete paid orders. Refund first.'}), 400
     
+    # A cancelled order already gave its stock back
+    if order.status != 'cancelled':
+        release_stock([order.id])
+    
+    db.session.add_all(orders_changed([order]))
     db.session.delete(order)
     db.session.commit()
     
     return jsonify({'message': 'Order deleted'}), 200
 
 # ==================== BULK OPERATIONS ====================
+# Each bulk endpoint is a single set-based statement; RETURNING tells the
+# client exactly which orders changed without loading them.
+
+def bulk_order_ids(data):
+    """The `order_ids` list from a bulk request, or None if it isn't a list of ints"""
+    order_ids = data.get('order_ids')
+    if not isinstance(order_ids, list) or not order_ids:
+        return None
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in order_ids):
+        return None
+    return order_ids
+
 @admin_orders_bp.route('/bulk-status', methods=['PUT'])
 @jwt_required()
 def bulk_update_status():
     """Update status for multiple orders"""
     data = request.get_json()
+    order_ids = bulk_order_ids(data)
     
-    if not data.get('order_ids') or not data.get('status'):
+    if not order_ids or not data.get('status'):
         return jsonify({'error': 'order_ids and status are required'}), 400
     
-    valid_statuses = ['pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']
-    
-    if data['status'] not in valid_statuses:
+    if data['status'] not in ORDER_STATUSES:
         return jsonify({'error': 'Invalid status'}), 400
     
-    order_ids = data['order_ids']
-    orders = Order.query.filter(Order.id.in_(order_ids)).all()
+    # Lock the orders (in id order) and move stock for those entering or
+    # leaving `cancelled`, as the single-order endpoint does
+    current = db.session.execute(
+        select(Order.id, Order.status)
+        .where(Order.id.in_(order_ids))
+        .order_by(Order.id)
+        .with_for_update()
+    ).all()
+    cancelling = data['status'] == 'cancelled'
+    try:
+        if cancelling:
+            release_stock([r.id for r in current if r.status != 'cancelled'])
+        else:
+            retake_stock([r.id for r in current if r.status == 'cancelled'])
+    except InsufficientStock:
+        db.session.rollback()
+        return jsonify({'error': 'Not enough stock left to restore the cancelled orders'}), 400
+    
+    values = {'status': data['status']}
+    if data['status'] == 'delivered':
+        # Keep the first delivery time of orders that were already delivered
+        values['delivered_at'] = func.coalesce(Order.delivered_at, func.now())
+    
+    rows = db.session.execute(
+        update(Order)
+        .where(Order.id.in_(order_ids))
+        .values(**values)
+        .returning(Order.id, Order.status, Order.delivered_at, Order.created_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.add_all(orders_changed(rows))
+    db.session.commit()
+    
+    return jsonify({
+        'message': f'{len(rows)} orders updated',
+        'updated_count': len(rows),
+        'orders': [{
+            'id': r.id,
+            'status': r.status,
+            'delivered_at': r.delivered_at.isoformat() if r.delivered_at else None
+        } for r in rows]
+    }), 200
+
+@admin_orders_bp.route('/bulk-payment-status', methods=['PUT'])
+@jwt_required()
+def bulk_update_payment_status():
+    """Update payment status for multiple orders"""
+    data = request.get_json()
+    order_ids = bulk_order_ids(data)
+    
+    if not order_ids or not data.get('payment_status'):
+        return jsonify({'error': 'order_ids and payment_status are required'}), 400
+    
+    if data['payment_status'] not in PAYMENT_STATUSES:
+        return jsonify({'error': 'Invalid payment status'}), 400
     
-    updated_count = 0
-    for order in orders:
-        order.status = data['status']
-        if data['status'] == 'delivered' and not order.delivered_at:
-            order.delivered_at = datetime.now()
-        updated_count += 1
+    rows = db.session.execute(
+        update(Order)
+        .where(Order.id.in_(order_ids))
+        .values(payment_status=data['payment_status'])
+        .returning(Order.id, Order.payment_status)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
     
+    return jsonify({
+        'message': f'{len(rows)} orders updated',
+        'updated_count': len(rows),
+        'orders': [{'id': r.id, 'payment_status': r.payment_status} for r in rows]
+    }), 200
+
+@admin_orders_bp.route('/bulk-delete', methods=['POST'])
+@jwt_required()
+def bulk_delete_orders():
+    """
+    Delete multiple orders. Same rules as deleting one: delivered and paid
+    orders are kept and reported back in `skipped_ids`.
+    """
+    data = request.get_json()
+    order_ids = bulk_order_ids(data)
+    
+    if not order_ids:
+        return jsonify({'error': 'order_ids are required'}), 400
+    
+    # Lock the deletable orders so a concurrent status change can't slip
+    # a delivered or paid order in between the guard and the delete
+    rows = db.session.execute(
+        select(Order.id, Order.status)
+        .where(
+            Order.id.in_(order_ids),
+            Order.status.is_distinct_from('delivered'),
+            Order.payment_status.is_distinct_from('paid')
+        )
+        .order_by(Order.id)
+        .with_for_update()
+    ).all()
+    deletable = [r.id for r in rows]
+    
+    deleted = []
+    if deletable:
+        release_stock([r.id for r in rows if r.status != 'cancelled'])
+        db.session.execute(
+            delete(OrderItem).where(OrderItem.order_id.in_(deletable))
+            .execution_options(synchronize_session=False)
+        )
+        deleted = db.session.execute(
+            delete(Order).where(Order.id.in_(deletable))
+            .returning(Order.id, Order.created_at)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.add_all(orders_changed(deleted))
     db.session.commit()
     
+    deleted_ids = {r.id for r in deleted}
     return jsonify({
-        'message': f'{updated_count} orders updated',
-        'updated_count': updated_count
-    }), 200
\ No newline at end of file
+        'message': f'{len(deleted_ids)} orders deleted',
+        'deleted_count': len(deleted_ids),
+        'deleted_ids': sorted(deleted_ids),
+        'skipped_ids': [i for i in dict.fromkeys(order_ids) if i not in deleted_ids]
+    }), 200
@@ -1,13 +1,20 @@
 from flask import Blueprint, jsonify, request
-from models import db, Product, Gender, ProductType
+from models import db, Product, Gender, ProductType, product_counts_by_type
 from sqlalchemy import func
+from sqlalchemy.orm import contains_eager, selectinload
+from category_snapshot import category_snapshots
 
 category_bp = Blueprint('categories', __name__, url_prefix='/api/categories')
 
 @category_bp.route('/', methods=['GET'])
 def get_all_categories():
-    """Get all genders with their product types"""
-    genders = Gender.query.all() # Gender is the top level now
+    """Get all genders with their product types (cached snapshot, supports If-None-Match)"""
+    return category_snapshots.respond('categories', build_categories)
+
+
+def build_categories():
+    genders = Gender.query.options(selectinload(Gender.product_types)).all() # Gender is the top level now
+    counts = product_counts_by_type()
     
     result = []
     for gender in genders:
@@ -20,24 +27,29 @@ def get_all_categories():
                     'id': pt.id,
                     'name': pt.name,
                     'slug': pt.slug,
-                    'product_count': len(pt.products)
+                    'product_count': counts.get(pt.id, 0)
                 }
                 for pt in gender.product_types # Relationship name change
             ]
         })
     
-    return jsonify({
+    return {
         'success': True,
         'categories': result
-    })
+    }
 
 
 @category_bp.route('/genders', methods=['GET'])
 def get_genders_list():
-    """Get all top-level genders (Men, Women, etc.)"""
-    genders = Gender.query.all()
+    """Get all top-level genders (Men, Women, etc.) (cached snapshot, supports If-None-Match)"""
+    return category_snapshots.respond('genders', build_genders_list)
+
+
+def build_genders_list():
+    genders = Gender.query.options(selectinload(Gender.product_types)).all()
+    counts = product_counts_by_type()
     
-    return jsonify({
+    return {
         'success': True,
         'genders': [
             {
@@ -45,11 +57,11 @@ def get_genders_list():
                 'name': g.name,
                 'slug': g.slug,
                 # Sum products across all associated ProductTypes
-                'total_products': sum(len(pt.products) for pt in g.product_types) 
+                'total_products': sum(counts.get(pt.id, 0) for pt in g.product_types)
             }
             for g in genders
         ]
-    })
+    }
 
 
 @category_bp.route('/product-types', methods=['GET'])
@@ -58,13 +70,14 @@ def get_product_types():
     # Filter by gender slug (e.g., /product-types?gender_slug=men)
     gender_slug = request.args.get('gender_slug') 
     
-    query = ProductType.query.join(Gender)
+    query = ProductType.query.join(Gender).options(contains_eager(ProductType.gender))
     
     if gender_slug:
         # Filter ProductType by its associated Gender's slug
-        query = query.filter(func.lower(Gender.slug) == gender_slug.lower()) 
+        query = query.filter(Gender.slug == gender_slug.lower()) 
     
     categories = query.all()
+    counts = product_counts_by_type()
     
     return jsonify({
         'success': True,
@@ -78,7 +91,7 @@ def get_product_types():
                     'name': pt.gender.name,
                     'slug': pt.gender.slug
                 },
-                'product_count': len(pt.products)
+                'product_count': counts.get(pt.id, 0)
             }
             for pt in categories # Variable name change
         ]
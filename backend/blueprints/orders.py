@@ -1,12 +1,20 @@
-from flask import Blueprint, jsonify, request
-from models import db, Order, OrderItem, Product
-from sqlalchemy import func
-from datetime import datetime
+from flask import Blueprint, current_app, jsonify, request
+from models import db, IdempotencyKey, Order, OrderItem, OutboxEvent, Product, ProductVariant
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import load_only, selectinload
+from inventory import sync_in_stock
+from serializers import column_field, columns_for, isoformat_or_none, parse_fields, render
+from collections import Counter
+from datetime import datetime, timedelta
+import hashlib
 import secrets
 import string
 
 order_bp = Blueprint('orders', __name__, url_prefix='/api/orders')
 
+# How long a checkout response is replayable for its Idempotency-Key
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
 
 def generate_order_number():
     """Generate a unique, recognizable order number"""
@@ -37,9 +45,41 @@ def create_order():
             }
         ]
     }
+    Optional header: Idempotency-Key, so a retried request replays the
+    original response instead of placing a second order.
     """
     data = request.get_json()
     
+    # 0. Replay a request we've already completed. The advisory lock (held
+    # until this transaction ends) makes a concurrent duplicate wait for the
+    # first attempt to commit instead of racing it.
+    idempotency_key = request.headers.get('Idempotency-Key')
+    request_hash = None
+    if idempotency_key:
+        if len(idempotency_key) > 255:
+            return jsonify({
+                'success': False,
+                'error': 'Idempotency-Key must be at most 255 characters'
+            }), 400
+        
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+        db.session.execute(select(func.pg_advisory_xact_lock(func.hashtext(idempotency_key))))
+        
+        # An expired key is forgotten, so the request runs as a new one
+        IdempotencyKey.query.filter(
+            IdempotencyKey.key == idempotency_key,
+            IdempotencyKey.created_at < func.now() - IDEMPOTENCY_KEY_TTL
+        ).delete(synchronize_session=False)
+        
+        stored = IdempotencyKey.query.get(idempotency_key)
+        if stored:
+            if stored.request_hash != request_hash:
+                return jsonify({
+                    'success': False,
+                    'error': 'Idempotency-Key was already used for a different request'
+                }), 422
+            return replay_response(stored)
+    
     # 1. Validate required fields
     required_fields = ['customer_name', 'customer_phone', 'address_line1', 'city', 'items']
     for field in required_fields:
@@ -60,8 +100,27 @@ def create_order():
         subtotal = 0.0
         order_items_data = []
         
+        # Fetch every referenced product and its variants in two plain reads.
+        # Nothing is locked here: a sold-out or invalid cart is rejected before
+        # any write, and the order_items foreign key share-locks the products
+        # once the items are inserted.
+        product_ids = {_as_id(item.get('product_id')) for item in data['items']}
+        product_ids.discard(None)
+        products = {
+            p.id: p for p in Product.query.filter(Product.id.in_(product_ids))
+        } if product_ids else {}
+        variants = {
+            (v.product_id, v.size, v.color): v for v in db.session.query(
+                ProductVariant.id, ProductVariant.product_id, ProductVariant.size,
+                ProductVariant.color, ProductVariant.stock_quantity
+            ).filter(ProductVariant.product_id.in_(product_ids))
+        } if product_ids else {}
+        has_variants = {product_id for product_id, _, _ in variants}
+        reserve = Counter()  # variant id -> quantity to take
+        
+        
         for item in data['items']:
-            product = Product.query.get(item.get('product_id'))
+            product = products.get(_as_id(item.get('product_id')))
             
             if not product:
                 return jsonify({
@@ -81,6 +140,22 @@ def create_order():
                     'success': False,
                     'error': f'Invalid quantity for product {product.id}'
                 }), 400
+            
+            variant = None
+            if product.id in has_variants:
+                variant = variants.get((product.id, *ProductVariant.key(item.get('size'), item.get('color'))))
+                if variant is None:
+                    return jsonify({
+                        'success': False,
+                        'error': f'Selected size/color is not available for "{product.title}"'
+                    }), 400
+                
+                reserve[variant.id] += quantity
+                if reserve[variant.id] > variant.stock_quantity:
+                    return jsonify({
+                        'success': False,
+                        'error': f'Product "{product.title}" is out of stock'
+                    }), 400
 
             item_price = float(product.price)
             item_subtotal = item_price * quantity
@@ -92,7 +167,8 @@ def create_order():
                 'size': item.get('size'),
                 'color': item.get('color'),
                 'price': item_price,
-                'subtotal': item_subtotal
+                'subtotal': item_subtotal,
+                'variant_id': variant.id if variant else None
             })
         
         # 3. Calculate shipping (e.g., free shipping over $100)
@@ -120,7 +196,33 @@ def create_order():
             except (ValueError, TypeError):
                 longitude = None
         
-        # 5. Create Order header
+        # 5. Reserve variant stock. Each decrement only matches while enough
+        # stock is left, so concurrent checkouts can't oversell and nobody
+        # holds a lock across the checks above. Variants are taken in id
+        # order so two carts can't deadlock on each other.
+        sold_out = set()  # products whose last unit of a variant we just took
+        for variant_id in sorted(reserve):
+            reserved = db.session.execute(
+                update(ProductVariant)
+                .where(ProductVariant.id == variant_id, ProductVariant.stock_quantity >= reserve[variant_id])
+                .values(stock_quantity=ProductVariant.stock_quantity - reserve[variant_id])
+                .returning(ProductVariant.product_id, ProductVariant.stock_quantity)
+                .execution_options(synchronize_session=False)
+            ).first()
+            
+            if reserved is None:
+                db.session.rollback()
+                return jsonify({
+                    'success': False,
+                    'error': 'Some items in your cart just sold out'
+                }), 400
+            if reserved.stock_quantity == 0:
+                sold_out.add(reserved.product_id)
+        
+        # Mark products out of stock once none of their variants are left
+        sync_in_stock(sold_out)
+        
+        # 6. Create Order header
         order = Order(
             order_number=generate_order_number(),
             customer_name=data['customer_name'],
@@ -132,6 +234,7 @@ def create_order():
             subtotal=subtotal,
             shipping_cost=shipping_cost,
             total=total,
+            item_count=sum(item_data['quantity'] for item_data in order_items_data),
             status='pending', # Initial status for customer orders
             payment_status='pending' # Assume payment integration happens next
         )
@@ -139,11 +242,8 @@ def create_order():
         db.session.add(order)
         db.session.flush() # Get order ID before adding items
         
-        # 6. Create Order Items and update Product sales count
+        # 7. Create Order Items
         for item_data in order_items_data:
-            # IMPORTANT: Increment the product's sales counter
-            item_data['product'].sales_count += item_data['quantity']
-            
             order_item = OrderItem(
                 order_id=order.id,
                 product_id=item_data['product'].id,
@@ -154,17 +254,35 @@ def create_order():
                 size=item_data['size'],
                 color=item_data['color'],
                 quantity=item_data['quantity'],
-                subtotal=item_data['subtotal']
+                subtotal=item_data['subtotal'],
+                variant_id=item_data['variant_id']  # what step 5 reserved, for cancel/delete
             )
             db.session.add(order_item)
         
-        db.session.commit()
+        # 8. Queue the follow-up work (sales counters, driver notification,
+        # analytics) for outbox_worker.py; it commits or rolls back with the order
+        db.session.add(OutboxEvent(event_type='order.created', payload={'order_id': order.id}))
         
-        return jsonify({
+        response = jsonify({
             'success': True,
             'message': 'Order created successfully. Proceed to payment.',
             'order': format_order(order, detailed=True)
-        }), 201
+        })
+        response.status_code = 201
+        
+        # 9. Remember the exact response bytes in the same transaction as the order
+        if idempotency_key:
+            db.session.add(IdempotencyKey(
+                key=idempotency_key,
+                request_hash=request_hash,
+                order_id=order.id,
+                response_status=response.status_code,
+                response_body=response.get_data(as_text=True)
+            ))
+        
+        db.session.commit()
+        
+        return response
         
     except Exception as e:
         db.session.rollback()
@@ -183,11 +301,16 @@ def get_order_by_id(order_id):
     (Used internally by the user's account page)
     """
     # NOTE: In a real app, this should also filter by user ID for security.
-    order = Order.query.get_or_404(order_id)
+    try:
+        fields = parse_fields(request.args.get('fields'), ORDER_DETAIL_FIELDS)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    order = order_query(fields).filter(Order.id == order_id).first_or_404()
     
     return jsonify({
         'success': True,
-        'order': format_order(order, detailed=True)
+        'order': format_order(order, detailed=True, fields=fields)
     })
 
 
@@ -197,44 +320,98 @@ def get_order_by_number(order_number):
     [CUSTOMER] Get order by unique order number.
     (Used for public order tracking lookup)
     """
-    order = Order.query.filter_by(order_number=order_number).first_or_404()
+    try:
+        fields = parse_fields(request.args.get('fields'), ORDER_DETAIL_FIELDS)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    order = order_query(fields).filter(Order.order_number == order_number).first_or_404()
     
     return jsonify({
         'success': True,
-        'order': format_order(order, detailed=True)
+        'order': format_order(order, detailed=True, fields=fields)
     })
 
 
 # ============ HELPER FUNCTIONS ============
 
-def format_order(order, detailed=False):
+def _as_id(value):
+    """
+    Cart product_id as an int, or None unless it is a real int or a string
+    of digits (1.5, true and "1.9" must not silently become product 1)
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    return None
+
+
+def purge_idempotency_keys():
+    """
+    Delete stored checkout responses older than IDEMPOTENCY_KEY_TTL; they
+    hold customer details and are of no use once clients stop retrying.
+    Run periodically by outbox_worker.py. Returns the number deleted.
+    """
+    deleted = IdempotencyKey.query.filter(
+        IdempotencyKey.created_at < func.now() - IDEMPOTENCY_KEY_TTL
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def replay_response(stored):
+    """The response saved for an Idempotency-Key, returned as-is"""
+    response = current_app.response_class(
+        stored.response_body, status=stored.response_status, mimetype='application/json'
+    )
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _coordinate(value):
+    return float(value) if value is not None else None
+
+
+# Response fields of an order (see serializers.py). `items` is relationship
+# backed and lists no columns; order_query() loads it when it is asked for.
+ORDER_FIELDS = {
+    'id': column_field(Order.id),
+    'order_number': column_field(Order.order_number),
+    'customer_name': column_field(Order.customer_name),
+    'customer_phone': column_field(Order.customer_phone),
+    'address_line1': column_field(Order.address_line1),
+    'city': column_field(Order.city),
+    'latitude': column_field(Order.latitude, _coordinate),
+    'longitude': column_field(Order.longitude, _coordinate),
+    'subtotal': column_field(Order.subtotal, float),
+    'shipping_cost': column_field(Order.shipping_cost, float),
+    'total': column_field(Order.total, float),
+    'status': column_field(Order.status),
+    'payment_status': column_field(Order.payment_status),
+    'created_at': column_field(Order.created_at, isoformat_or_none),
+    'item_count': column_field(Order.item_count),
+}
+
+ORDER_DETAIL_FIELDS = {
+    **ORDER_FIELDS,
+    'updated_at': column_field(Order.updated_at, isoformat_or_none),
+    'delivered_at': column_field(Order.delivered_at, isoformat_or_none),
+    'items': ((), lambda order: [format_order_item(item) for item in order.order_items]),
+}
+
+
+def order_query(fields):
+    """Order query that only loads the columns (and items) `fields` needs"""
+    query = Order.query.options(load_only(*columns_for(ORDER_DETAIL_FIELDS, fields, Order.id)))
+    if fields is None or 'items' in fields:
+        query = query.options(selectinload(Order.order_items))
+    return query
+
+
+def format_order(order, detailed=False, fields=None):
     """Format order data for JSON response"""
-    base_data = {
-        'id': order.id,
-        'order_number': order.order_number,
-        'customer_name': order.customer_name,
-        'customer_phone': order.customer_phone,
-        'address_line1': order.address_line1,
-        'city': order.city,
-        'latitude': float(order.latitude) if order.latitude is not None else None,
-        'longitude': float(order.longitude) if order.longitude is not None else None,
-        'subtotal': float(order.subtotal),
-        'shipping_cost': float(order.shipping_cost),
-        'total': float(order.total),
-        'status': order.status,
-        'payment_status': order.payment_status,
-        'created_at': order.created_at.isoformat() if order.created_at else None,
-        'item_count': order.item_count
-    }
-    
-    if detailed:
-        base_data.update({
-            'updated_at': order.updated_at.isoformat() if order.updated_at else None,
-            'delivered_at': order.delivered_at.isoformat() if order.delivered_at else None,
-            'items': [format_order_item(item) for item in order.order_items]
-        })
-    
-    return base_data
+    return render(order, ORDER_DETAIL_FIELDS if detailed else ORDER_FIELDS, fields)
 
 
 def format_order_item(item):
@@ -1,6 +1,13 @@
 from flask import Blueprint, jsonify, request
-from models import db, Product, Gender, ProductType
-from sqlalchemy import func, and_, or_
+from models import Product
+from collections import Counter
+from category_cache import category_cache
+from facets import facet_index
+from pagination import keyset_paginate, InvalidCursor
+from serializers import (
+    column_field, columns_for, float_or_none, isoformat_or_none,
+    json_response, parse_fields, product_type_field, render
+)
 
 product_bp = Blueprint('products', __name__, url_prefix='/api/products')
 
@@ -21,14 +28,12 @@ def get_all_products():
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
     
-    query = Product.query.join(ProductType).join(Gender)
+    query = Product.query
     
-    # Apply filters
-    if gender_slug:
-        query = query.filter(func.lower(Gender.slug) == gender_slug.lower())
-    
-    if product_type_slug:
-        query = query.filter(func.lower(ProductType.slug) == product_type_slug.lower())
+    # Apply filters (slugs resolve to product type ids, no joins)
+    type_ids = category_cache.product_type_ids(gender_slug, product_type_slug)
+    if type_ids is not None:
+        query = query.filter(Product.product_type_id.in_(type_ids))
     
     if is_new is not None:
         query = query.filter(Product.is_new == is_new)
@@ -39,12 +44,12 @@ def get_all_products():
     # Size filter
     if sizes:
         size_list = [s.strip() for s in sizes.split(',')]
-        query = query.filter(Product.sizes.op('&&')(size_list))
+        query = query.filter(Product.sizes.overlap(size_list))
 
     # Color filter  
     if colors:
         color_list = [c.strip().lower() for c in colors.split(',')]
-        query = query.filter(Product.colors.op('&&')(color_list))
+        query = query.filter(Product.colors.overlap(color_list))
     
     # Price range filter
     if min_price is not None:
@@ -53,31 +58,27 @@ def get_all_products():
     if max_price is not None:
         query = query.filter(Product.price <= max_price)
     
-    # Apply sorting
-    if sort_by == 'price':
-        query = query.order_by(Product.price.desc() if order == 'desc' else Product.price.asc())
-    elif sort_by == 'name':
-        query = query.order_by(Product.title.desc() if order == 'desc' else Product.title.asc())
-    else:  # created_at
-        query = query.order_by(Product.created_at.desc() if order == 'desc' else Product.created_at.asc())
-    
-    products = query.all()
-    
-    return jsonify({
-        'success': True,
-        'count': len(products),
-        'products': [format_product(p) for p in products]
-    })
+    return listing_response(query, sort_by, order)
 
 
 @product_bp.route('/<int:product_id>', methods=['GET'])
 def get_product_by_id(product_id):
     """Get single product by ID"""
-    product = Product.query.get_or_404(product_id)
+    try:
+        fields = parse_fields(request.args.get('fields'), PRODUCT_DETAIL_FIELDS)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    product = (
+        Product.query
+        .filter(Product.id == product_id)
+        .with_entities(*columns_for(PRODUCT_DETAIL_FIELDS, fields))
+        .first_or_404()
+    )
     
     return jsonify({
         'success': True,
-        'product': format_product(product, detailed=True)
+        'product': format_product(product, detailed=True, fields=fields)
     })
 
 
@@ -98,14 +99,9 @@ def get_products_by_gender(gender_slug):
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
     
-    query = Product.query.join(ProductType).join(Gender)
-    
-    # Filter by Gender (main filter)
-    query = query.filter(func.lower(Gender.slug) == gender_slug.lower())
-    
-    # Optional filter: filter by a ProductType within this Gender
-    if product_type_slug:
-        query = query.filter(func.lower(ProductType.slug) == product_type_slug.lower())
+    # Filter by Gender (main filter), optionally narrowed to one of its ProductTypes
+    type_ids = category_cache.product_type_ids(gender_slug, product_type_slug)
+    query = Product.query.filter(Product.product_type_id.in_(type_ids))
     
     if is_new is not None:
         query = query.filter(Product.is_new == is_new)
@@ -116,12 +112,12 @@ def get_products_by_gender(gender_slug):
     # Size filter
     if sizes:
         size_list = [s.strip() for s in sizes.split(',')]
-        query = query.filter(Product.sizes.op('&&')(size_list))
+        query = query.filter(Product.sizes.overlap(size_list))
 
     # Color filter  
     if colors:
         color_list = [c.strip().lower() for c in colors.split(',')]
-        query = query.filter(Product.colors.op('&&')(color_list))
+        query = query.filter(Product.colors.overlap(color_list))
     
     # Price range filter
     if min_price is not None:
@@ -130,22 +126,7 @@ def get_products_by_gender(gender_slug):
     if max_price is not None:
         query = query.filter(Product.price <= max_price)
     
-    # Sorting
-    if sort_by == 'price':
-        query = query.order_by(Product.price.desc() if order == 'desc' else Product.price.asc())
-    elif sort_by == 'name':
-        query = query.order_by(Product.title.desc() if order == 'desc' else Product.title.asc())
-    else:
-        query = query.order_by(Product.created_at.desc() if order == 'desc' else Product.created_at.asc())
-    
-    products = query.all()
-    
-    return jsonify({
-        'success': True,
-        'gender': gender_slug,
-        'count': len(products),
-        'products': [format_product(p) for p in products]
-    })
+    return listing_response(query, sort_by, order, gender=gender_slug)
 
 
 @product_bp.route('/product-type/<product_type_slug>', methods=['GET'])
@@ -165,8 +146,8 @@ def get_products_by_product_type(product_type_slug):
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
     
-    query = Product.query.join(ProductType)
-    query = query.filter(ProductType.slug == product_type_slug)
+    type_ids = category_cache.product_type_ids(product_type_slug=product_type_slug)
+    query = Product.query.filter(Product.product_type_id.in_(type_ids))
     
     if is_new is not None:
         query = query.filter(Product.is_new == is_new)
@@ -177,12 +158,12 @@ def get_products_by_product_type(product_type_slug):
     # Size filter
     if sizes:
         size_list = [s.strip() for s in sizes.split(',')]
-        query = query.filter(Product.sizes.op('&&')(size_list))
+        query = query.filter(Product.sizes.overlap(size_list))
 
     # Color filter  
     if colors:
         color_list = [c.strip().lower() for c in colors.split(',')]
-        query = query.filter(Product.colors.op('&&')(color_list))
+        query = query.filter(Product.colors.overlap(color_list))
     
     # Price range filter
     if min_price is not None:
@@ -191,22 +172,7 @@ def get_products_by_product_type(product_type_slug):
     if max_price is not None:
         query = query.filter(Product.price <= max_price)
     
-    # Sorting
-    if sort_by == 'price':
-        query = query.order_by(Product.price.desc() if order == 'desc' else Product.price.asc())
-    elif sort_by == 'name':
-        query = query.order_by(Product.title.desc() if order == 'desc' else Product.title.asc())
-    else:
-        query = query.order_by(Product.created_at.desc() if order == 'desc' else Product.created_at.asc())
-    
-    products = query.all()
-    
-    return jsonify({
-        'success': True,
-        'product_type_slug': product_type_slug,
-        'count': len(products),
-        'products': [format_product(p) for p in products]
-    })
+    return listing_response(query, sort_by, order, product_type_slug=product_type_slug)
 
 
 # ============ NEW ENDPOINT: Get Available Filter Options ============
@@ -220,72 +186,113 @@ def get_filter_options():
     gender_slug = request.args.get('gender_slug')
     product_type_slug = request.args.get('product_type_slug')
     
-    query = Product.query.join(ProductType).join(Gender)
-    
-    if gender_slug:
-        query = query.filter(func.lower(Gender.slug) == gender_slug.lower())
-    
-    if product_type_slug:
-        query = query.filter(func.lower(ProductType.slug) == product_type_slug.lower())
-    
-    products = query.all()
+    # Served from the in-process facet index, no database round trip
+    size_counts, color_counts, min_price, max_price = facet_index.facets(gender_slug, product_type_slug)
     
-    # Extract unique sizes and colors
-    all_sizes = set()
-    all_colors = set()
-    prices = []
-    
-    for product in products:
-        if product.sizes:
-            all_sizes.update(product.sizes)
-        if product.colors:
-            all_colors.update([c.lower() for c in product.colors])
-        prices.append(float(product.price))
+    colors = Counter()
+    for color, count in color_counts.items():
+        colors[color.lower()] += count
     
     return jsonify({
         'success': True,
-        'sizes': sorted(list(all_sizes)),
-        'colors': sorted(list(all_colors)),
+        'sizes': sorted(size_counts),
+        'colors': sorted(colors),
+        'size_counts': dict(size_counts),
+        'color_counts': dict(colors),
         'price_range': {
-            'min': min(prices) if prices else 0,
-            'max': max(prices) if prices else 1000
+            'min': float(min_price) if min_price is not None else 0,
+            'max': float(max_price) if max_price is not None else 1000
         }
     })
 
 
 # ============ HELPER FUNCTIONS ============
 
-def format_product(product, detailed=False):
-    """Format product data for JSON response"""
-    base_data = {
-        'id': product.id,
-        'title': product.title,
-        'description': product.description,
-        'price': float(product.price),
-        'original_price': float(product.original_price) if product.original_price else None,
-        'images': product.images,
-        'in_stock': product.in_stock,
-        'is_new': product.is_new,
-        'is_sale': product.is_sale,
-        'sizes': product.sizes,
-        'colors': product.colors,
-        'product_type': {
-            'id': product.product_type.id,
-            'name': product.product_type.name,
-            'slug': product.product_type.slug,
-            'gender': {
-                'id': product.product_type.gender.id,
-                'name': product.product_type.gender.name,
-                'slug': product.product_type.gender.slug
-            }
-        }
-    }
-    
-    if detailed:
-        base_data.update({
-            'review_count': product.review_count,
-            'sales_count': product.sales_count,
-            'created_at': product.created_at.isoformat() if product.created_at else None
+# Response fields of a product, built from plain column rows (see
+# serializers.py). Listings select only the columns of the requested fields,
+# so `?fields=id,title,price` never reads description from Postgres.
+PRODUCT_FIELDS = {
+    'id': column_field(Product.id),
+    'title': column_field(Product.title),
+    'description': column_field(Product.description),
+    'price': column_field(Product.price, float),
+    'original_price': column_field(Product.original_price, float_or_none),
+    'images': column_field(Product.images),
+    'in_stock': column_field(Product.in_stock),
+    'is_new': column_field(Product.is_new),
+    'is_sale': column_field(Product.is_sale),
+    'sizes': column_field(Product.sizes),
+    'colors': column_field(Product.colors),
+    'product_type': product_type_field(with_gender=True),
+}
+
+PRODUCT_DETAIL_FIELDS = {
+    **PRODUCT_FIELDS,
+    'review_count': column_field(Product.review_count),
+    'sales_count': column_field(Product.sales_count),
+    'created_at': column_field(Product.created_at, isoformat_or_none),
+}
+
+SORT_COLUMNS = {
+    'created_at': Product.created_at,
+    'price': Product.price,
+    'name': Product.title,
+}
+
+
+def listing_response(query, sort_by, order, **extra):
+    """
+    Sort and serialize a product listing.
+
+    Without `cursor`/`limit` in the query string the whole matching set is
+    returned, as before. With either of them the listing is paged on
+    (sort key, id) and the response carries an opaque `next_cursor`.
+    `fields` limits the product keys (and selected columns) in the response.
+    """
+    sort_by = sort_by if sort_by in SORT_COLUMNS else 'created_at'
+    column = SORT_COLUMNS[sort_by]
+    descending = order == 'desc'
+
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+
+    try:
+        fields = parse_fields(request.args.get('fields'), PRODUCT_FIELDS)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    if cursor is None and limit is None:
+        query = query.with_entities(*columns_for(PRODUCT_FIELDS, fields))
+        query = query.order_by(column.desc() if descending else column.asc())
+        rows = query.all()
+        return json_response({
+            'success': True,
+            **extra,
+            'count': len(rows),
+            'products': [format_product(r, fields=fields) for r in rows]
         })
-    
-    return base_data
\ No newline at end of file
+
+    # The cursor is built from the sort value and id of the last row
+    query = query.with_entities(*columns_for(PRODUCT_FIELDS, fields, Product.id, column))
+
+    try:
+        rows, next_cursor = keyset_paginate(
+            query, sort_by, column, Product.id, descending,
+            cursor=cursor, limit=limit
+        )
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return json_response({
+        'success': True,
+        **extra,
+        'count': len(rows),
+        'products': [format_product(r, fields=fields) for r in rows],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    })
+
+
+def format_product(row, detailed=False, fields=None):
+    """Format a product row (selected with columns_for) for JSON response"""
+    return render(row, PRODUCT_DETAIL_FIELDS if detailed else PRODUCT_FIELDS, fields)
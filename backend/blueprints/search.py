@@ -1,6 +1,16 @@
+import re
 from flask import Blueprint, request, jsonify
-from models import db, Product, ProductType, Gender
-from sqlalchemy import or_, and_, func
+from models import db, Product
+from sqlalchemy import or_, func, select
+from category_cache import category_cache
+from category_snapshot import category_snapshots
+from facets import facet_index
+from pagination import COUNT_MODES, count_cache_key, paginate
+from suggest import MAX_SUGGESTIONS, suggest_index
+from serializers import (
+    column_field, columns_for, gender_field, json_response, parse_fields,
+    product_type_field, render, str_or_none
+)
 
 search_bp = Blueprint('search', __name__, url_prefix='/api/search')
 
@@ -13,7 +23,9 @@ def global_search():
     - q: search query (required, min 2 chars)
     - page: page number (default: 1)
     - per_page: results per page (default: 8)
-    - sort: newest (default), price_low, price_high, popular
+    - sort: newest (default), price_low, price_high, popular, relevance
+    - fields: comma-separated result keys to return (default: all)
+    - count: exact (default), cached, none (skip the COUNT; use has_next)
     """
     query_str = request.args.get('q', '').strip()
     
@@ -27,57 +39,62 @@ def global_search():
     per_page = request.args.get('per_page', 8, type=int)
     sort = request.args.get('sort', 'newest')
     
-    # Build search query (case-insensitive)
-    search_pattern = f"%{query_str}%"
-    query = Product.query.filter(
-        or_(
-            Product.title.ilike(search_pattern),
-            Product.description.ilike(search_pattern)
-        )
-    )
+    count = request.args.get('count', 'exact')
+    if count not in COUNT_MODES:
+        return jsonify({'error': 'Invalid count mode'}), 400
+    
+    try:
+        fields = parse_fields(request.args.get('fields'), SEARCH_RESULT_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Build search query (full-text, prefix-matched)
+    query, rank = apply_text_search(Product.query, query_str)
     
     # Apply sorting
-    if sort == 'price_low':
-        query = query.order_by(Product.price.asc())
-    elif sort == 'price_high':
-        query = query.order_by(Product.price.desc())
-    elif sort == 'popular':
-        query = query.order_by(Product.sales_count.desc())
-    else:  # newest (default)
-        query = query.order_by(Product.created_at.desc())
+    query = apply_search_sort(query, sort, rank)
     
     # Paginate
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    columns = columns_for(SEARCH_RESULT_FIELDS, fields)
+    pagination = paginate(
+        query.with_entities(*columns), page, per_page,
+        count=count, cache_key=count_cache_key('search.global', request.args)
+    )
     
-    return jsonify({
+    return json_response({
         'query': query_str,
-        'results': [{
-            'id': p.id,
-            'title': p.title,
-            'price': str(p.price),
-            'original_price': str(p.original_price) if p.original_price else None,
-            'images': p.images,
-            'in_stock': p.in_stock,
-            'is_new': p.is_new,
-            'is_sale': p.is_sale,
-            'product_type': {
-                'id': p.product_type.id,
-                'name': p.product_type.name,
-                'slug': p.product_type.slug
-            },
-            'gender': {
-                'id': p.product_type.gender.id,
-                'name': p.product_type.gender.name,
-                'slug': p.product_type.gender.slug
-            }
-        } for p in pagination.items],
+        'results': [render(r, SEARCH_RESULT_FIELDS, fields) for r in pagination.items],
         'total': pagination.total,
         'pages': pagination.pages,
+        'has_next': pagination.has_next,
         'current_page': page,
         'per_page': per_page
     }), 200
 
 
+# ==================== TYPEAHEAD ====================
+@search_bp.route('/suggest', methods=['GET'])
+def suggest():
+    """
+    Autocomplete for the search box, served from the in-memory prefix index
+    Query params:
+    - q: typed text (required)
+    - limit: max suggestions (default/max: 10)
+    """
+    query_str = request.args.get('q', '').strip()
+    
+    if not query_str:
+        return jsonify({'error': 'Search query is required'}), 400
+    
+    limit = request.args.get('limit', MAX_SUGGESTIONS, type=int)
+    limit = max(1, min(limit, MAX_SUGGESTIONS))
+    
+    return jsonify({
+        'query': query_str,
+        'suggestions': suggest_index.suggest(query_str, limit)
+    }), 200
+
+
 # ==================== CATEGORY/FILTERED SEARCH ====================
 @search_bp.route('/products', methods=['GET'])
 def filtered_search():
@@ -94,36 +111,35 @@ def filtered_search():
     - min_price: minimum price
     - max_price: maximum price
     - in_stock: true/false (default: true)
-    - sort: newest (default), price_low, price_high, popular
+    - sort: newest (default), price_low, price_high, popular, relevance
     - page: page number (default: 1)
     - per_page: results per page (default: 12)
+    - fields: comma-separated product keys to return (default: all)
+    - count: exact (default), cached, none (skip the COUNT; use has_next)
     """
+    count = request.args.get('count', 'exact')
+    if count not in COUNT_MODES:
+        return jsonify({'error': 'Invalid count mode'}), 400
+    
+    try:
+        fields = parse_fields(request.args.get('fields'), SEARCH_PRODUCT_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     query = Product.query
     
     # Search query (optional)
     search_str = request.args.get('q', '').strip()
+    rank = None
     if search_str and len(search_str) >= 2:
-        search_pattern = f"%{search_str}%"
-        query = query.filter(
-            or_(
-                Product.title.ilike(search_pattern),
-                Product.description.ilike(search_pattern)
-            )
-        )
+        query, rank = apply_text_search(query, search_str)
     
-    # Filter by gender
+    # Filter by gender / product type (slugs resolve to product type ids, no joins)
     gender_slug = request.args.get('gender')
-    if gender_slug:
-        query = query.join(ProductType).join(Gender).filter(
-            Gender.slug == gender_slug
-        )
-    
-    # Filter by product type
     product_type_slug = request.args.get('product_type')
-    if product_type_slug:
-        query = query.join(ProductType).filter(
-            ProductType.slug == product_type_slug
-        )
+    type_ids = category_cache.product_type_ids(gender_slug, product_type_slug)
+    if type_ids is not None:
+        query = query.filter(Product.product_type_id.in_(type_ids))
     
     # Filter: On Sale
     if request.args.get('on_sale') == 'true':
@@ -137,15 +153,13 @@ def filtered_search():
     sizes_param = request.args.get('sizes')
     if sizes_param:
         sizes_list = [s.strip() for s in sizes_param.split(',')]
-        size_filters = [Product.sizes.contains([size]) for size in sizes_list]
-        query = query.filter(or_(*size_filters))
+        query = query.filter(Product.sizes.overlap(sizes_list))
     
     # Filter: Colors
     colors_param = request.args.get('colors')
     if colors_param:
         colors_list = [c.strip() for c in colors_param.split(',')]
-        color_filters = [Product.colors.contains([color]) for color in colors_list]
-        query = query.filter(or_(*color_filters))
+        query = query.filter(Product.colors.overlap(colors_list))
     
     # Filter: Price range
     min_price = request.args.get('min_price', type=float)
@@ -162,47 +176,22 @@ def filtered_search():
     
     # Sorting
     sort = request.args.get('sort', 'newest')
-    if sort == 'price_low':
-        query = query.order_by(Product.price.asc())
-    elif sort == 'price_high':
-        query = query.order_by(Product.price.desc())
-    elif sort == 'popular':
-        query = query.order_by(Product.sales_count.desc())
-    else:  # newest (default)
-        query = query.order_by(Product.created_at.desc())
+    query = apply_search_sort(query, sort, rank)
     
     # Pagination
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 12, type=int)
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    columns = columns_for(SEARCH_PRODUCT_FIELDS, fields)
+    pagination = paginate(
+        query.with_entities(*columns), page, per_page,
+        count=count, cache_key=count_cache_key('search.products', request.args)
+    )
     
-    return jsonify({
-        'products': [{
-            'id': p.id,
-            'title': p.title,
-            'description': p.description,
-            'price': str(p.price),
-            'original_price': str(p.original_price) if p.original_price else None,
-            'images': p.images,
-            'sizes': p.sizes,
-            'colors': p.colors,
-            'in_stock': p.in_stock,
-            'is_new': p.is_new,
-            'is_sale': p.is_sale,
-            'sales_count': p.sales_count,
-            'product_type': {
-                'id': p.product_type.id,
-                'name': p.product_type.name,
-                'slug': p.product_type.slug
-            },
-            'gender': {
-                'id': p.product_type.gender.id,
-                'name': p.product_type.gender.name,
-                'slug': p.product_type.gender.slug
-            }
-        } for p in pagination.items],
+    return json_response({
+        'products': [render(r, SEARCH_PRODUCT_FIELDS, fields) for r in pagination.items],
         'total': pagination.total,
         'pages': pagination.pages,
+        'has_next': pagination.has_next,
         'current_page': page,
         'per_page': per_page,
         'filters_applied': {
@@ -221,6 +210,71 @@ def filtered_search():
     }), 200
 
 
+# ==================== TEXT SEARCH ====================
+
+SEARCH_CONFIG = 'english'
+
+
+def apply_text_search(query, text):
+    """
+    Filter on Product.search_vector (GIN indexed) instead of ILIKE scans.
+
+    Every word is prefix-matched so partially typed words still hit
+    ("den jack" finds "Denim Jacket"). Returns (query, rank), where rank is
+    the weighted relevance expression for sort=relevance. Input with no
+    indexable words, or only stop words ("the"), falls back to a substring
+    match and a None rank.
+    """
+    words = re.findall(r'[^\W_]+', text.lower())
+    ts_query = func.to_tsquery(SEARCH_CONFIG, ' & '.join(f'{w}:*' for w in words))
+    # One tiny round trip: only the database knows which words are stop words
+    if not words or db.session.scalar(select(func.numnode(ts_query))) == 0:
+        pattern = f"%{text}%"
+        return query.filter(or_(Product.title.ilike(pattern), Product.description.ilike(pattern))), None
+
+    query = query.filter(Product.search_vector.op('@@')(ts_query))
+    return query, func.ts_rank_cd(Product.search_vector, ts_query)
+
+
+def apply_search_sort(query, sort, rank=None):
+    """Order search results; relevance needs a rank from apply_text_search"""
+    if sort == 'price_low':
+        return query.order_by(Product.price.asc())
+    if sort == 'price_high':
+        return query.order_by(Product.price.desc())
+    if sort == 'popular':
+        return query.order_by(Product.sales_count.desc())
+    if sort == 'relevance' and rank is not None:
+        return query.order_by(rank.desc(), Product.created_at.desc())
+    return query.order_by(Product.created_at.desc())  # newest (default)
+
+
+# ==================== SERIALIZERS ====================
+
+# Field specs for the search listings (see serializers.py); rows are plain
+# column tuples, and `?fields=` trims both the SELECT list and the JSON.
+SEARCH_RESULT_FIELDS = {
+    'id': column_field(Product.id),
+    'title': column_field(Product.title),
+    'price': column_field(Product.price, str),
+    'original_price': column_field(Product.original_price, str_or_none),
+    'images': column_field(Product.images),
+    'in_stock': column_field(Product.in_stock),
+    'is_new': column_field(Product.is_new),
+    'is_sale': column_field(Product.is_sale),
+    'product_type': product_type_field(),
+    'gender': gender_field(),
+}
+
+SEARCH_PRODUCT_FIELDS = {
+    **SEARCH_RESULT_FIELDS,
+    'description': column_field(Product.description),
+    'sizes': column_field(Product.sizes),
+    'colors': column_field(Product.colors),
+    'sales_count': column_field(Product.sales_count),
+}
+
+
 # ==================== GET FILTER OPTIONS ====================
 @search_bp.route('/filters', methods=['GET'])
 def get_filter_options():
@@ -230,71 +284,61 @@ def get_filter_options():
     - gender: filter options for specific gender
     - product_type: filter options for specific product type
     """
-    query = Product.query
-    
     gender_slug = request.args.get('gender')
-    if gender_slug:
-        query = query.join(ProductType).join(Gender).filter(
-            Gender.slug == gender_slug
-        )
-    
     product_type_slug = request.args.get('product_type')
-    if product_type_slug:
-        query = query.join(ProductType).filter(
-            ProductType.slug == product_type_slug
-        )
-    
-    products = query.all()
-    
-    all_sizes = set()
-    all_colors = set()
     
-    for p in products:
-        if p.sizes:
-            all_sizes.update(p.sizes)
-        if p.colors:
-            all_colors.update(p.colors)
-    
-    price_query = query.with_entities(
-        func.min(Product.price).label('min_price'),
-        func.max(Product.price).label('max_price')
-    ).first()
+    # Served from the in-process facet index, no database round trip
+    size_counts, color_counts, min_price, max_price = facet_index.facets(gender_slug, product_type_slug)
     
     return jsonify({
-        'sizes': sorted(list(all_sizes)),
-        'colors': sorted(list(all_colors)),
+        'sizes': sorted(size_counts),
+        'colors': sorted(color_counts),
+        'size_counts': dict(size_counts),
+        'color_counts': dict(color_counts),
         'price_range': {
-            'min': float(price_query.min_price) if price_query.min_price else 0,
-            'max': float(price_query.max_price) if price_query.max_price else 0
+            'min': float(min_price) if min_price else 0,
+            'max': float(max_price) if max_price else 0
         }
     }), 200
 
 
 # ==================== GENDER HERO IMAGE ====================
+
+EMPTY_GENDER_HERO = {'image': None, 'title': None, 'product_type': None}
+
+
 @search_bp.route('/gender-hero/<string:gender_slug>', methods=['GET'])
 def get_gender_hero(gender_slug):
     """
     Returns the most recently added product that has at least one image,
     for a given gender slug. Used to power the mega-menu hero image.
+    Served from a cached snapshot; supports If-None-Match.
     """
+    gender_slug = gender_slug.lower()
+    # Only real genders get a snapshot, so made-up slugs can't fill the cache
+    if category_cache.gender_by_slug(gender_slug) is None:
+        return jsonify(EMPTY_GENDER_HERO), 200
+    return category_snapshots.respond(('gender-hero', gender_slug), lambda: build_gender_hero(gender_slug))
+
+
+def build_gender_hero(gender_slug):
     product = (
         Product.query
-        .join(ProductType)
-        .join(Gender)
         .filter(
-            Gender.slug == gender_slug,
+            Product.product_type_id.in_(category_cache.product_type_ids(gender_slug)),
             Product.images != None,
             func.array_length(Product.images, 1) > 0
         )
+        .with_entities(Product.title, Product.images, Product.product_type_id)
         .order_by(Product.created_at.desc())
         .first()
     )
 
     if not product:
-        return jsonify({'image': None, 'title': None, 'product_type': None}), 200
+        return EMPTY_GENDER_HERO
 
-    return jsonify({
+    return {
         'image': product.images[0],
         'title': product.title,
-        'product_type': product.product_type.name,
-    }), 200
\ No newline at end of file
+        'product_type': category_cache.product_type(product.product_type_id).name,
+    }
\ No newline at end of file
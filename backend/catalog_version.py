@@ -0,0 +1,40 @@
+"""
+Version of the catalog the in-process caches are built from: the category
+cache, the facet index, the suggest index and the category snapshots.
+
+The admin catalog writes bump it, so every cache this worker built from
+an earlier version is rebuilt on its next lookup. Writes that went
+through another worker can't bump it here; MAX_AGE bounds how long those
+stay invisible.
+"""
+import threading
+import time
+
+MAX_AGE = 60  # seconds
+
+
+class CatalogVersion:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    @property
+    def value(self):
+        return self._value
+
+    def bump(self):
+        """Mark every catalog cache stale; returns the new version"""
+        with self._lock:
+            self._value += 1
+            return self._value
+
+    def is_current(self, version, built_at):
+        """Whether a cache built from `version` at `built_at` (monotonic) can still be served"""
+        return (
+            version == self._value
+            and built_at is not None
+            and time.monotonic() - built_at <= MAX_AGE
+        )
+
+
+catalog_version = CatalogVersion()
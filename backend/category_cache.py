@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import namedtuple
+from catalog_version import catalog_version
+from models import db, Gender, ProductType
+
+# A slug that isn't cached reloads the cache, but at most this often, so
+# requests for unknown slugs can't turn into a query each.
+MISS_REFRESH_INTERVAL = 5  # seconds
+
+CachedGender = namedtuple('CachedGender', 'id name slug')
+CachedProductType = namedtuple('CachedProductType', 'id name slug gender_id')
+
+
+class CategoryCache:
+    """
+    Process-wide copy of the Gender/ProductType tables. Lets product queries
+    filter on products.product_type_id directly instead of joining both
+    tables to match a slug, and lets serializers fill in category names.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._built_at = None
+        self._version = None
+
+    def refresh(self):
+        version = catalog_version.value  # a bump during the reload triggers another
+        genders = {
+            g.id: CachedGender(g.id, g.name, g.slug)
+            for g in db.session.query(Gender.id, Gender.name, Gender.slug)
+        }
+        types = {
+            pt.id: CachedProductType(pt.id, pt.name, pt.slug, pt.gender_id)
+            for pt in db.session.query(ProductType.id, ProductType.name, ProductType.slug, ProductType.gender_id)
+        }
+        state = {
+            'genders': genders,
+            'types': types,
+            'gender_by_slug': {g.slug: g.id for g in genders.values()},
+            'type_by_slug': {pt.slug: pt.id for pt in types.values()},
+        }
+        with self._lock:
+            self._state = state
+            self._built_at = time.monotonic()
+            self._version = version
+        return state
+
+    def _current(self):
+        with self._lock:
+            state, built_at, version = self._state, self._built_at, self._version
+        if not catalog_version.is_current(version, built_at):
+            state = self.refresh()
+        return state
+
+    def _by_slug(self, key, slug):
+        """
+        (state, id) for `slug` in state[key], reloading once on a miss
+        (a category created through another worker) unless the cache was
+        built less than MISS_REFRESH_INTERVAL ago.
+        """
+        state = self._current()
+        found = state[key].get(slug.lower())
+        if found is None:
+            with self._lock:
+                built_at = self._built_at
+            if built_at is None or time.monotonic() - built_at > MISS_REFRESH_INTERVAL:
+                state = self.refresh()
+                found = state[key].get(slug.lower())
+        return state, found
+
+    def product_type_ids(self, gender_slug=None, product_type_slug=None):
+        """
+        Ids of the product types matching the given slugs, for an
+        `IN (...)` filter. None means no category filter was requested;
+        an empty list means nothing matches.
+        """
+        if not gender_slug and not product_type_slug:
+            return None
+
+        if product_type_slug:
+            state, type_id = self._by_slug('type_by_slug', product_type_slug)
+            if type_id is None:
+                return []
+            if gender_slug and self._by_slug('gender_by_slug', gender_slug)[1] != state['types'][type_id].gender_id:
+                return []
+            return [type_id]
+
+        state, gender_id = self._by_slug('gender_by_slug', gender_slug)
+        return [pt.id for pt in state['types'].values() if pt.gender_id == gender_id]
+
+    def gender_by_slug(self, slug):
+        """The cached gender with this slug, or None if there is none"""
+        gender_id = self._by_slug('gender_by_slug', slug)[1]
+        return self.gender(gender_id) if gender_id is not None else None
+
+    def product_type(self, type_id):
+        state = self._current()
+        if type_id not in state['types']:
+            state = self.refresh()  # created through another worker
+        return state['types'].get(type_id)
+
+    def gender(self, gender_id):
+        state = self._current()
+        if gender_id not in state['genders']:
+            state = self.refresh()
+        return state['genders'].get(gender_id)
+
+
+category_cache = CategoryCache()
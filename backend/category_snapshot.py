@@ -0,0 +1,77 @@
+import gzip
+import hashlib
+import threading
+import time
+from flask import current_app, request
+from catalog_version import catalog_version
+
+MAX_SNAPSHOTS = 256
+
+
+class Snapshot:
+    """A serialized response body and its gzip encoding, each with its own strong ETag"""
+    __slots__ = ('version', 'built_at', 'body', 'gzipped', 'etag', 'gzip_etag')
+
+    def __init__(self, version, body):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.body = body
+        # mtime=0 keeps the gzip bytes identical across workers for the same body
+        self.gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.gzip_etag = f'{self.etag}-gz'
+
+
+class CategorySnapshots:
+    """
+    Prebuilt responses for the navigation data (category tree, genders,
+    hero images). They only change when an admin edits the catalog, so
+    they are rebuilt on a catalog version bump instead of on every
+    request, and revalidations are answered with 304 without touching the
+    database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}
+
+    def get(self, key, build):
+        """Current snapshot for `key`, calling build() for a fresh payload if needed"""
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None and catalog_version.is_current(snapshot.version, snapshot.built_at):
+            return snapshot
+
+        version = catalog_version.value
+        body = current_app.json.response(build()).get_data()
+        snapshot = Snapshot(version, body)
+
+        with self._lock:
+            # Re-inserted so the dict stays in build order; a full cache
+            # drops its oldest build rather than everything
+            self._snapshots.pop(key, None)
+            while len(self._snapshots) >= MAX_SNAPSHOTS:
+                del self._snapshots[next(iter(self._snapshots))]
+            self._snapshots[key] = snapshot
+        return snapshot
+
+    def respond(self, key, build):
+        """Serve a snapshot with ETag/If-None-Match and gzip negotiation"""
+        snapshot = self.get(key, build)
+        use_gzip = 'gzip' in request.accept_encodings
+        etag = snapshot.gzip_etag if use_gzip else snapshot.etag
+
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        elif use_gzip:
+            response = current_app.response_class(snapshot.gzipped, mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = current_app.response_class(snapshot.body, mimetype='application/json')
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+category_snapshots = CategorySnapshots()
@@ -0,0 +1,132 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from models import db, Product
+from category_cache import category_cache
+from catalog_version import catalog_version
+
+
+class _Bucket:
+    """Facets of every product in one product type"""
+    __slots__ = ('sizes', 'colors', 'prices')
+
+    def __init__(self):
+        self.sizes = Counter()
+        self.colors = Counter()
+        self.prices = []  # kept sorted so min/max survive removals
+
+    def add(self, sizes, colors, price):
+        self.sizes.update(sizes)
+        self.colors.update(colors)
+        insort(self.prices, price)
+
+    def remove(self, sizes, colors, price):
+        self.sizes.subtract(sizes)
+        self.colors.subtract(colors)
+        for counter in (self.sizes, self.colors):
+            for key in [k for k, v in counter.items() if v <= 0]:
+                del counter[key]
+        i = bisect_left(self.prices, price)
+        if i < len(self.prices) and self.prices[i] == price:
+            del self.prices[i]
+
+
+class FacetIndex:
+    """
+    In-process index of the filter sidebar data: per product type, the sizes
+    and colors in use (with product counts) and the price range. Answers
+    /filters without touching the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._products = {}   # product id -> (product_type_id, sizes, colors, price)
+        self._buckets = {}    # product_type_id -> _Bucket
+        self._built_at = None
+        self._version = None  # catalog version the index reflects
+
+    # ---------- building ----------
+
+    def rebuild(self):
+        """Reload everything from the database"""
+        with self._lock:
+            version = catalog_version.value
+            rows = db.session.query(
+                Product.id, Product.product_type_id, Product.sizes, Product.colors, Product.price
+            ).all()
+
+            self._products = {}
+            self._buckets = {}
+            for row in rows:
+                self._add(row.id, row.product_type_id, row.sizes, row.colors, row.price)
+            self._built_at = time.monotonic()
+            self._version = version
+
+    def _ensure_built(self):
+        if not catalog_version.is_current(self._version, self._built_at):
+            self.rebuild()
+
+    # ---------- incremental updates ----------
+
+    def _add(self, product_id, product_type_id, sizes, colors, price):
+        entry = (product_type_id, tuple(sizes or ()), tuple(colors or ()), price)
+        self._products[product_id] = entry
+        self._buckets.setdefault(product_type_id, _Bucket()).add(*entry[1:])
+
+    def _discard(self, product_id):
+        entry = self._products.pop(product_id, None)
+        if entry:
+            self._buckets[entry[0]].remove(*entry[1:])
+
+    def _advance(self, version):
+        """
+        Whether the write that bumped the catalog to `version` can be
+        applied in place. An index that missed an earlier write stays
+        behind and is rebuilt on the next lookup instead.
+        """
+        if self._built_at is None or self._version != version - 1:
+            return False
+        self._version = version
+        return True
+
+    def upsert_product(self, product, version):
+        """Apply a created or updated product, saved as catalog `version`"""
+        with self._lock:
+            if self._advance(version):
+                self._discard(product.id)
+                self._add(product.id, product.product_type_id, product.sizes, product.colors, product.price)
+
+    def remove_product(self, product_id, version):
+        """Apply a deleted product, removed as catalog `version`"""
+        with self._lock:
+            if self._advance(version):
+                self._discard(product_id)
+
+    # ---------- lookups ----------
+
+    def facets(self, gender_slug=None, product_type_slug=None):
+        """
+        Return (size counts, color counts, min price, max price) over the
+        matching product types. Prices are None when nothing matches.
+        Slugs are resolved through the category cache.
+        """
+        type_ids = category_cache.product_type_ids(gender_slug, product_type_slug)
+
+        with self._lock:
+            self._ensure_built()
+
+            sizes, colors, low, high = Counter(), Counter(), None, None
+            for type_id in self._buckets if type_ids is None else type_ids:
+                bucket = self._buckets.get(type_id)
+                if not bucket or not bucket.prices:
+                    continue
+                sizes.update(bucket.sizes)
+                colors.update(bucket.colors)
+                low = bucket.prices[0] if low is None else min(low, bucket.prices[0])
+                high = bucket.prices[-1] if high is None else max(high, bucket.prices[-1])
+
+            return sizes, colors, low, high
+
+
+facet_index = FacetIndex()
@@ -0,0 +1,44 @@
+import hashlib
+import math
+
+# 2^12 one-byte registers: 4 KB per sketch, ~1.6% standard error
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+STANDARD_ERROR = 1.04 / math.sqrt(REGISTERS)
+
+_HASH_BITS = 64
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+
+class HyperLogLog:
+    """
+    Distinct-count sketch. Sketches of disjoint or overlapping sets merge
+    into the sketch of their union (register-wise max), so per-day
+    sketches answer "distinct customers between any two days".
+    """
+    __slots__ = ('registers',)
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers) if registers else bytearray(REGISTERS)
+
+    def add(self, value):
+        h = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        index = h >> (_HASH_BITS - PRECISION)
+        rest = h & ((1 << (_HASH_BITS - PRECISION)) - 1)
+        rank = (_HASH_BITS - PRECISION) - rest.bit_length() + 1  # position of the first 1 bit
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        estimate = _ALPHA * REGISTERS * REGISTERS / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            return round(REGISTERS * math.log(REGISTERS / zeros))  # linear counting for small sets
+        return round(estimate)
+
+    def to_bytes(self):
+        return bytes(self.registers)
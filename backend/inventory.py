@@ -0,0 +1,91 @@
+"""
+Variant stock kept in step with the orders that hold it.
+
+Checkout takes stock (blueprints/orders.py) and records the variant on
+each order item it reserved for; cancelling or deleting an order gives
+exactly that back and un-cancelling takes it again. Items without a
+recorded variant (products without variants, orders from before
+reservations were recorded) never touch stock.
+
+Lock order is variants (by id), then products (by id) everywhere, so
+checkout and the admin endpoints can't deadlock on each other.
+"""
+from sqlalchemy import case, exists, func, select, update
+from models import db, OrderItem, Product, ProductVariant
+
+
+class InsufficientStock(Exception):
+    """Not enough variant stock left to take an order's items again"""
+
+
+def order_variant_quantities(order_ids):
+    """{variant id: quantity} reserved by the items of `order_ids`"""
+    rows = db.session.execute(
+        select(OrderItem.variant_id, func.sum(OrderItem.quantity))
+        .where(OrderItem.order_id.in_(order_ids), OrderItem.variant_id.isnot(None))
+        .group_by(OrderItem.variant_id)
+    ).all()
+    return {variant_id: quantity for variant_id, quantity in rows}
+
+
+def release_stock(order_ids):
+    """Return the stock held by `order_ids` (cancelled or deleted orders)"""
+    _move_stock(order_ids, 1)
+
+
+def retake_stock(order_ids):
+    """
+    Take the stock of `order_ids` again (orders leaving `cancelled`).
+    Raises InsufficientStock, changing nothing, if any variant is short.
+    """
+    _move_stock(order_ids, -1)
+
+
+def _move_stock(order_ids, sign):
+    quantities = order_variant_quantities(order_ids) if order_ids else {}
+    if not quantities:
+        return
+
+    variants = db.session.execute(
+        select(ProductVariant.id, ProductVariant.product_id, ProductVariant.stock_quantity)
+        .where(ProductVariant.id.in_(quantities))
+        .order_by(ProductVariant.id)
+        .with_for_update()
+    ).all()
+    if sign < 0 and any(v.stock_quantity < quantities[v.id] for v in variants):
+        raise InsufficientStock()
+
+    db.session.execute(
+        update(ProductVariant)
+        .where(ProductVariant.id.in_(quantities))
+        .values(stock_quantity=ProductVariant.stock_quantity + sign * case(quantities, value=ProductVariant.id))
+        .execution_options(synchronize_session=False)
+    )
+    sync_in_stock({v.product_id for v in variants})
+
+
+def sync_in_stock(product_ids):
+    """
+    Set products.in_stock from variant stock for the products in
+    `product_ids` that have variants. Callers must already hold the
+    locks on the variants they changed. The product rows are locked first
+    so concurrent callers see each other's stock, and a row is only
+    written when its flag actually flips.
+    """
+    if not product_ids:
+        return
+
+    db.session.execute(
+        select(Product.id)
+        .where(Product.id.in_(product_ids))
+        .order_by(Product.id)
+        .with_for_update(key_share=True)
+    ).all()
+    has_variants = exists().where(ProductVariant.product_id == Product.id)
+    has_stock = exists().where(ProductVariant.product_id == Product.id, ProductVariant.stock_quantity > 0)
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(product_ids), has_variants, Product.in_stock.is_distinct_from(has_stock))
+        .values(in_stock=has_stock)
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,6 @@
+-- Composite indexes backing cursor pagination of /api/products listings.
+-- New databases get these from db.create_all(); run this once on existing ones.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_created_at_id ON products (created_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_price_id ON products (price, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_title_id ON products (title, id);
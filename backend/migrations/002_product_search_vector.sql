@@ -0,0 +1,12 @@
+-- Full-text search for /api/search. The column is generated, so adding it
+-- backfills every existing row and Postgres keeps it current on writes.
+
+ALTER TABLE products
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_search_vector
+    ON products USING gin (search_vector);
@@ -0,0 +1,9 @@
+-- Index-friendly catalog filters: GIN indexes for the size/color overlap
+-- (&&) filters and lowercase slugs so lookups are plain equality.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_sizes ON products USING gin (sizes);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_colors ON products USING gin (colors);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_product_types_slug ON product_types (slug);
+
+UPDATE genders SET slug = lower(slug) WHERE slug <> lower(slug);
+UPDATE product_types SET slug = lower(slug) WHERE slug <> lower(slug);
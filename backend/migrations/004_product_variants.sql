@@ -0,0 +1,12 @@
+-- Per size x color stock. Checkout reserves stock with conditional
+-- decrements (stock_quantity >= n), the CHECK is a backstop.
+
+CREATE TABLE IF NOT EXISTS product_variants (
+    id SERIAL PRIMARY KEY,
+    product_id INTEGER NOT NULL REFERENCES products (id) ON DELETE CASCADE,
+    size VARCHAR(20) NOT NULL DEFAULT '',
+    color VARCHAR(50) NOT NULL DEFAULT '',
+    stock_quantity INTEGER NOT NULL DEFAULT 0,
+    CONSTRAINT uq_product_variants_product_size_color UNIQUE (product_id, size, color),
+    CONSTRAINT ck_product_variants_stock_quantity CHECK (stock_quantity >= 0)
+);
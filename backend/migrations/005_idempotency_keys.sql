@@ -0,0 +1,11 @@
+-- Checkout responses keyed by the client's Idempotency-Key header, so a
+-- retried POST /api/orders/ replays the original order.
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key VARCHAR(255) PRIMARY KEY,
+    request_hash VARCHAR(64) NOT NULL,
+    order_id INTEGER NOT NULL REFERENCES orders (id) ON DELETE CASCADE,
+    response_status INTEGER NOT NULL,
+    response_body TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
@@ -0,0 +1,13 @@
+-- Transactional outbox: written with the order, drained by outbox_worker.py.
+
+CREATE TABLE IF NOT EXISTS outbox_events (
+    id BIGSERIAL PRIMARY KEY,
+    event_type VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    processed_at TIMESTAMP WITH TIME ZONE,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_outbox_events_pending ON outbox_events (id) WHERE processed_at IS NULL;
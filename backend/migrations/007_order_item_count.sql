@@ -0,0 +1,8 @@
+-- Persist each order's item count so listings don't load order_items.
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS item_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE orders o
+SET item_count = s.quantity
+FROM (SELECT order_id, sum(quantity) AS quantity FROM order_items GROUP BY order_id) s
+WHERE s.order_id = o.id AND o.item_count <> s.quantity;
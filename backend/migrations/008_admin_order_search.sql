@@ -0,0 +1,14 @@
+-- Admin orders list: (created_at, id) for newest-first keyset paging,
+-- trigram indexes for the substring search, and a digits-only phone
+-- column so "+961 3 123 456" is found by "3123456".
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS customer_phone_digits VARCHAR(50)
+    GENERATED ALWAYS AS (regexp_replace(customer_phone, '\D', '', 'g')) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_created_at_id ON orders (created_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_order_number_trgm ON orders USING gin (order_number gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_customer_name_trgm ON orders USING gin (customer_name gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_city_trgm ON orders USING gin (city gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_customer_phone_digits_trgm ON orders USING gin (customer_phone_digits gin_trgm_ops);
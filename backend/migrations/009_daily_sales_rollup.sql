@@ -0,0 +1,22 @@
+-- Daily sales rollups for the admin dashboard, keyed by Beirut-local day.
+-- After creating the tables, backfill them with: python rollup.py
+
+CREATE TABLE IF NOT EXISTS daily_sales (
+    day DATE NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    orders INTEGER NOT NULL DEFAULT 0,
+    revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, status)
+);
+
+CREATE TABLE IF NOT EXISTS daily_product_sales (
+    day DATE NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    product_id INTEGER NOT NULL REFERENCES products (id) ON DELETE CASCADE,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, status, product_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_daily_product_sales_product_id ON daily_product_sales (product_id);
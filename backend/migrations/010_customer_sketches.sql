@@ -0,0 +1,9 @@
+-- HyperLogLog sketches of customer phones per Beirut-local day and month.
+-- After creating the table, fill it with: python rollup.py
+
+CREATE TABLE IF NOT EXISTS customer_sketches (
+    period VARCHAR(5) NOT NULL,
+    start DATE NOT NULL,
+    registers BYTEA NOT NULL,
+    PRIMARY KEY (period, start)
+);
@@ -0,0 +1,3 @@
+-- Idempotency keys expire after 24 hours; outbox_worker.py purges them by created_at.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_idempotency_keys_created_at ON idempotency_keys (created_at);
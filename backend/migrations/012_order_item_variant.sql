@@ -0,0 +1,8 @@
+-- Record which variant's stock checkout reserved for each order item, so
+-- cancelling or deleting an order only returns stock that was taken.
+-- Existing items stay NULL, so cancelling an older order returns nothing.
+-- That under-counts for orders placed since 004, but can never add stock
+-- that was not taken.
+
+ALTER TABLE order_items ADD COLUMN IF NOT EXISTS variant_id INTEGER
+    REFERENCES product_variants (id) ON DELETE SET NULL;
@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from sqlalchemy import func
+from sqlalchemy import DDL, event, func
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TSVECTOR
+from sqlalchemy.orm import deferred, joinedload
 import pytz
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -13,7 +15,7 @@ class Gender(db.Model):
     __tablename__ = 'genders'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
-    slug = db.Column(db.String(255), unique=True, nullable=False)
+    slug = db.Column(db.String(255), unique=True, nullable=False)  # stored lowercase
     
     product_types = db.relationship("ProductType", back_populates="gender")
 
@@ -23,7 +25,7 @@ class ProductType(db.Model):
     __tablename__ = 'product_types'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
-    slug = db.Column(db.String(255), nullable=False)
+    slug = db.Column(db.String(255), nullable=False, index=True)  # stored lowercase
     
     gender_id = db.Column(db.Integer, db.ForeignKey('genders.id'), nullable=False)
     gender = db.relationship("Gender", back_populates="product_types")
@@ -33,7 +35,7 @@ class ProductType(db.Model):
 class Product(db.Model):
     __tablename__ = 'products'
     id = db.Column(db.Integer, primary_key=True)
-    images = db.Column(db.ARRAY(db.String), nullable=True)
+    images = db.Column(ARRAY(db.String), nullable=True)
     title = db.Column(db.String(255), unique=True, nullable=False)
     description = db.Column(db.Text)
     price = db.Column(db.DECIMAL(10, 2), nullable=False)
@@ -49,11 +51,76 @@ class Product(db.Model):
     product_type = db.relationship("ProductType", back_populates="products")
     
     # Optional clothing-specific attributes
-    sizes = db.Column(db.ARRAY(db.String), nullable=True)  # S, M, L, XL
-    colors = db.Column(db.ARRAY(db.String), nullable=True)
+    sizes = db.Column(ARRAY(db.String), nullable=True)  # S, M, L, XL
+    colors = db.Column(ARRAY(db.String), nullable=True)
+    
+    # Full-text search document, maintained by Postgres (title weighted above description)
+    search_vector = deferred(db.Column(
+        TSVECTOR,
+        db.Computed(
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'B')",
+            persisted=True
+        )
+    ))
     
     # Relationship to order items
     order_items = db.relationship("OrderItem", back_populates="product")
+    
+    # Per size/color stock; products without variants only use in_stock
+    variants = db.relationship("ProductVariant", back_populates="product", cascade="all, delete-orphan", order_by="ProductVariant.id")
+    
+    __table_args__ = (
+        # Keyset pagination on (sort key, id) for the public listings
+        db.Index('ix_products_created_at_id', 'created_at', 'id'),
+        db.Index('ix_products_price_id', 'price', 'id'),
+        db.Index('ix_products_title_id', 'title', 'id'),
+        db.Index('ix_products_search_vector', 'search_vector', postgresql_using='gin'),
+        # Size/color filters are array overlaps (&&)
+        db.Index('ix_products_sizes', 'sizes', postgresql_using='gin'),
+        db.Index('ix_products_colors', 'colors', postgresql_using='gin'),
+    )
+
+class ProductVariant(db.Model):
+    """Stock quantity for one size x color of a product"""
+    __tablename__ = 'product_variants'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    size = db.Column(db.String(20), nullable=False, default='')  # '' when the product has no sizes
+    color = db.Column(db.String(50), nullable=False, default='')  # '' when the product has no colors
+    stock_quantity = db.Column(db.Integer, nullable=False, default=0)
+    
+    product = db.relationship("Product", back_populates="variants")
+    
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'size', 'color', name='uq_product_variants_product_size_color'),
+        # Last line of defence against overselling; checkout decrements conditionally
+        db.CheckConstraint('stock_quantity >= 0', name='ck_product_variants_stock_quantity'),
+    )
+    
+    @staticmethod
+    def key(size, color):
+        """(size, color) as stored, for matching cart options to a variant"""
+        return ((size or '').strip(), (color or '').strip())
+    
+    def __repr__(self):
+        return f'<ProductVariant {self.product_id} {self.size}/{self.color}>'
+
+def product_hierarchy():
+    """
+    Loader option that brings a Product's ProductType and Gender back in the
+    same SELECT. Use it on every query whose rows get serialized with their
+    category, otherwise each row costs two extra lazy loads.
+    """
+    return joinedload(Product.product_type, innerjoin=True).joinedload(ProductType.gender, innerjoin=True)
+
+def product_counts_by_type():
+    """{product_type_id: number of products}, in one grouped query"""
+    return dict(
+        db.session.query(Product.product_type_id, func.count(Product.id))
+        .group_by(Product.product_type_id)
+        .all()
+    )
 
 class Order(db.Model):
     __tablename__ = 'orders'
@@ -63,6 +130,11 @@ class Order(db.Model):
     # Customer delivery information
     customer_name = db.Column(db.String(255), nullable=False)
     customer_phone = db.Column(db.String(50), nullable=False)
+    # Digits only, so admin search matches "+961 3 123 456" by "3123456"
+    customer_phone_digits = deferred(db.Column(
+        db.String(50),
+        db.Computed(r"regexp_replace(customer_phone, '\D', '', 'g')", persisted=True)
+    ))
     
     # Delivery address
     address_line1 = db.Column(db.String(255), nullable=False)
@@ -74,6 +146,7 @@ class Order(db.Model):
     subtotal = db.Column(db.DECIMAL(10, 2), nullable=False)
     shipping_cost = db.Column(db.DECIMAL(10, 2), default=0.00)
     total = db.Column(db.DECIMAL(10, 2), nullable=False)
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # sum of item quantities, set at checkout
     
     # Order status
     status = db.Column(db.String(50), default='pending')  # pending, confirmed, processing, shipped, delivered, cancelled
@@ -87,13 +160,21 @@ class Order(db.Model):
     # Relationships
     order_items = db.relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
     
+    __table_args__ = (
+        # Admin list: newest first, keyset paged on (created_at, id)
+        db.Index('ix_orders_created_at_id', 'created_at', 'id'),
+        # Trigram indexes for the admin search's substring matches
+        db.Index('ix_orders_order_number_trgm', 'order_number', postgresql_using='gin', postgresql_ops={'order_number': 'gin_trgm_ops'}),
+        db.Index('ix_orders_customer_name_trgm', 'customer_name', postgresql_using='gin', postgresql_ops={'customer_name': 'gin_trgm_ops'}),
+        db.Index('ix_orders_city_trgm', 'city', postgresql_using='gin', postgresql_ops={'city': 'gin_trgm_ops'}),
+        db.Index('ix_orders_customer_phone_digits_trgm', 'customer_phone_digits', postgresql_using='gin', postgresql_ops={'customer_phone_digits': 'gin_trgm_ops'}),
+    )
+    
     def __repr__(self):
         return f'<Order {self.order_number}>'
-    
-    @property
-    def item_count(self):
-        """Total number of items in the order"""
-        return sum(item.quantity for item in self.order_items)
+
+# The trigram indexes above need pg_trgm before db.create_all() builds the table
+event.listen(Order.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
@@ -114,6 +195,10 @@ class OrderItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False, default=1)
     subtotal = db.Column(db.DECIMAL(10, 2), nullable=False)  # price * quantity
     
+    # Variant whose stock checkout reserved for this item; NULL when nothing
+    # was reserved (product had no variants, or order predates them)
+    variant_id = db.Column(db.Integer, db.ForeignKey('product_variants.id', ondelete='SET NULL'), nullable=True)
+    
     # Relationships
     order = db.relationship("Order", back_populates="order_items")
     product = db.relationship("Product", back_populates="order_items")
@@ -121,6 +206,78 @@ class OrderItem(db.Model):
     def __repr__(self):
         return f'<OrderItem {self.product_title} x{self.quantity}>'
 
+class IdempotencyKey(db.Model):
+    """Stored result of a checkout, replayed when a client retries with the same Idempotency-Key"""
+    __tablename__ = 'idempotency_keys'
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)  # sha256 of the request body
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'), nullable=False)
+    response_status = db.Column(db.Integer, nullable=False)
+    response_body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), index=True)  # expiry
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key}>'
+
+class OutboxEvent(db.Model):
+    """
+    Follow-up work for a committed write (counters, notifications,
+    analytics). Rows are added in the same transaction as the write and
+    drained by outbox_worker.py.
+    """
+    __tablename__ = 'outbox_events'
+    id = db.Column(db.BigInteger, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)  # order.created, ...
+    payload = db.Column(JSONB, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    processed_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    
+    __table_args__ = (
+        # The worker only ever scans the pending tail
+        db.Index('ix_outbox_events_pending', 'id', postgresql_where=db.text('processed_at IS NULL')),
+    )
+    
+    def __repr__(self):
+        return f'<OutboxEvent {self.id} {self.event_type}>'
+
+class DailySales(db.Model):
+    """
+    Orders rolled up per Beirut-local day and status, maintained by
+    rollup.py. Dashboard totals read this instead of scanning orders.
+    """
+    __tablename__ = 'daily_sales'
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.DECIMAL(14, 2), nullable=False, default=0)  # sum of order totals
+    units = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyProductSales(db.Model):
+    """Order items rolled up per Beirut-local day, order status and product"""
+    __tablename__ = 'daily_product_sales'
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.DECIMAL(14, 2), nullable=False, default=0)  # sum of item subtotals
+    
+    __table_args__ = (
+        db.Index('ix_daily_product_sales_product_id', 'product_id'),
+    )
+
+class CustomerSketch(db.Model):
+    """
+    HyperLogLog sketch (hll.py) of the customer phones that ordered in a
+    Beirut-local day or month, maintained by rollup.py. Merging sketches
+    gives approximate distinct customers for any range of days.
+    """
+    __tablename__ = 'customer_sketches'
+    period = db.Column(db.String(5), primary_key=True)  # day, month
+    start = db.Column(db.Date, primary_key=True)
+    registers = db.Column(db.LargeBinary, nullable=False)
+
 class Admin(db.Model):
     __tablename__ = 'admins'
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,269 @@
+"""
+Drains the outbox_events table: the work an order triggers that the
+customer shouldn't wait for. Run it next to the web app:
+
+    python outbox_worker.py              # poll forever
+    python outbox_worker.py --once       # drain what's pending and exit
+    python outbox_worker.py --threads 4
+
+Several workers (or threads) can run at once; each batch is claimed
+with FOR UPDATE SKIP LOCKED, so no event is handled twice concurrently.
+Database effects commit together with the event being marked processed,
+and a batch failure counts as an attempt for each of its events.
+
+The driver notification is its own driver.notify event, queued by
+order.created: it is only marked processed once the send succeeded, so
+it is delivered at least once (retried up to MAX_ATTEMPTS). Analytics
+is best effort and goes out after the commit. Processed events are
+purged after OUTBOX_RETENTION.
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import date, timedelta
+from sqlalchemy import case, func, update
+from app import app
+from models import db, Order, OrderItem, OutboxEvent, Product
+from blueprints.orders import get_delivery_info, purge_idempotency_keys
+from rollup import refresh_days, sales_day
+
+BATCH_SIZE = 100
+POLL_INTERVAL = 2  # seconds between polls when the outbox is empty
+MAX_ATTEMPTS = 5  # failing events are left for a human after this many tries
+PURGE_INTERVAL = 3600  # seconds between purges of expired keys and processed events
+OUTBOX_RETENTION = timedelta(days=7)  # processed events are kept this long for debugging
+
+
+# ==================== NOTIFIERS ====================
+
+class LogNotifier:
+    """Stand-in driver notifier: prints the message instead of sending it"""
+
+    def send(self, delivery_info):
+        print(f"[driver] {json.dumps(delivery_info, ensure_ascii=False)}")
+
+
+notifier = LogNotifier()
+
+
+# ==================== HANDLERS ====================
+
+def bump_sales_counts(order_id):
+    """Add an order's quantities to products.sales_count in one UPDATE"""
+    sold = dict(
+        db.session.query(OrderItem.product_id, func.sum(OrderItem.quantity))
+        .filter(OrderItem.order_id == order_id)
+        .group_by(OrderItem.product_id)
+        .all()
+    )
+    if not sold:
+        return
+
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(sold))
+        .values(sales_count=func.coalesce(Product.sales_count, 0) + case(sold, value=Product.id))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def track_order(event):
+    """Stand-in analytics sink: one JSON line per order"""
+    print(f"[analytics] order_created {json.dumps(event)}")
+
+
+class Batch:
+    """Work collected while handling a batch and done once at the end"""
+
+    def __init__(self):
+        self.sales_days = set()  # rollup days to refresh
+        self.after_commit = []  # external side effects, run once the batch is committed
+
+    def run_after_commit(self):
+        for action, argument in self.after_commit:
+            try:
+                action(argument)
+            except Exception as e:
+                print(f"Outbox side effect {action.__name__} failed: {e}")
+
+
+def handle_order_created(payload, batch):
+    order = Order.query.get(payload['order_id'])
+    if order is None:
+        return  # deleted before we got to it
+
+    bump_sales_counts(order.id)
+    batch.sales_days.add(sales_day(order.created_at))
+    # Committed with this event; sent (and retried) as its own event
+    db.session.add(OutboxEvent(event_type='driver.notify', payload={'order_id': order.id}))
+    batch.after_commit.append((track_order, {
+        'order_number': order.order_number,
+        'total': float(order.total),
+        'city': order.city,
+        'created_at': order.created_at.isoformat() if order.created_at else None
+    }))
+
+
+def handle_driver_notify(payload, batch):
+    """Send the delivery details; raising leaves the event pending for a retry"""
+    order = Order.query.get(payload['order_id'])
+    if order is None:
+        return  # deleted before we got to it
+    notifier.send(get_delivery_info(order))
+
+
+def handle_order_changed(payload, batch):
+    """Status change, edit or delete; the day is in the payload since the order may be gone"""
+    batch.sales_days.add(date.fromisoformat(payload['day']))
+
+
+def handle_rollup_refresh(payload, batch):
+    """A day whose batched refresh failed, retried on its own so failures count as attempts"""
+    refresh_days([date.fromisoformat(payload['day'])])
+
+
+HANDLERS = {
+    'order.created': handle_order_created,
+    'driver.notify': handle_driver_notify,
+    'order.changed': handle_order_changed,
+    'rollup.refresh': handle_rollup_refresh,
+}
+
+
+# ==================== WORKER LOOP ====================
+
+def drain(batch_size=BATCH_SIZE):
+    """Handle one batch of pending events; returns how many were claimed"""
+    events = (
+        OutboxEvent.query
+        .filter(OutboxEvent.processed_at.is_(None), OutboxEvent.attempts < MAX_ATTEMPTS)
+        .order_by(OutboxEvent.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+    event_ids = [event.id for event in events]
+
+    batch = Batch()
+    try:
+        for event in events:
+            try:
+                # A failing handler only undoes its own writes
+                with db.session.begin_nested():
+                    HANDLERS[event.event_type](event.payload, batch)
+                event.processed_at = func.now()
+            except Exception as e:
+                event.attempts += 1
+                event.last_error = f"{type(e).__name__}: {e}"
+                print(f"Outbox event {event.id} ({event.event_type}) failed: {e}")
+
+        refresh_rollups(batch.sales_days)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        record_batch_failure(event_ids, e)
+        raise
+
+    batch.run_after_commit()
+    return len(events)
+
+
+def refresh_rollups(days):
+    """
+    Rebuild each touched day once per batch, however many orders hit it.
+    The refresh runs in its own savepoint: if it fails, the batch's
+    counters and processed marks still commit, and every day gets a
+    rollup.refresh event to be retried (with attempts) on its own.
+    """
+    if not days:
+        return
+    try:
+        with db.session.begin_nested():
+            refresh_days(days)
+    except Exception as e:
+        print(f"Rollup refresh of {len(days)} day(s) failed, queued for retry: {e}")
+        db.session.add_all([
+            OutboxEvent(event_type='rollup.refresh', payload={'day': day.isoformat()})
+            for day in sorted(days)
+        ])
+
+
+def record_batch_failure(event_ids, error):
+    """Count a failed batch against each of its events, so MAX_ATTEMPTS bounds the retries"""
+    if not event_ids:
+        return
+    db.session.execute(
+        update(OutboxEvent)
+        .where(OutboxEvent.id.in_(event_ids))
+        .values(attempts=OutboxEvent.attempts + 1, last_error=f"batch: {type(error).__name__}: {error}")
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def purge_processed_events():
+    """Delete events processed more than OUTBOX_RETENTION ago; returns the number deleted"""
+    deleted = OutboxEvent.query.filter(
+        OutboxEvent.processed_at < func.now() - OUTBOX_RETENTION
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def purge_expired():
+    for purge, what in [(purge_idempotency_keys, 'expired idempotency key(s)'),
+                        (purge_processed_events, 'processed outbox event(s)')]:
+        try:
+            deleted = purge()
+            if deleted:
+                print(f"Purged {deleted} {what}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Purge of {what} failed: {e}")
+
+
+def run(batch_size=BATCH_SIZE, interval=POLL_INTERVAL, once=False):
+    with app.app_context():
+        purged_at = None
+        while True:
+            if purged_at is None or time.monotonic() - purged_at > PURGE_INTERVAL:
+                purge_expired()
+                purged_at = time.monotonic()
+
+            try:
+                handled = drain(batch_size)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Outbox batch failed: {e}")
+                handled = 0  # back off before retrying
+                if once:
+                    raise
+
+            if handled < batch_size:
+                if once:
+                    return
+                time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Process pending outbox events')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help='seconds to sleep when idle')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--once', action='store_true', help='exit once the outbox is empty')
+    args = parser.parse_args()
+
+    threads = [
+        threading.Thread(target=run, args=(args.batch_size, args.interval, args.once), daemon=True)
+        for _ in range(max(1, args.threads))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import tuple_
+
+DEFAULT_CURSOR_LIMIT = 24
+MAX_CURSOR_LIMIT = 100
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+# ==================== CURSOR ENCODING ====================
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {'t': 'dt', 'v': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'t': 'dec', 'v': str(value)}
+    return {'t': 'raw', 'v': value}
+
+
+def _load_value(data):
+    kind, value = data['t'], data['v']
+    if kind == 'dt':
+        return datetime.fromisoformat(value)
+    if kind == 'dec':
+        return Decimal(value)
+    return value
+
+
+def encode_cursor(sort_key, value, row_id):
+    """Pack the (sort value, id) of the last row into an opaque URL-safe token"""
+    raw = json.dumps({'s': sort_key, 'k': _dump_value(value), 'id': row_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort_key):
+    """Unpack a cursor issued by encode_cursor for the same sort key"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if data['s'] != sort_key:
+            raise InvalidCursor('Cursor does not match the requested sort')
+        return _load_value(data['k']), int(data['id'])
+    except InvalidCursor:
+        raise
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor('Malformed cursor') from e
+
+
+def clamp_limit(limit):
+    if limit is None or limit <= 0:
+        return DEFAULT_CURSOR_LIMIT
+    return min(limit, MAX_CURSOR_LIMIT)
+
+
+# ==================== KEYSET PAGINATION ====================
+
+def keyset_paginate(query, sort_key, column, id_column, descending, cursor=None, limit=None):
+    """
+    Page a query on (column, id) instead of OFFSET.
+
+    The query must not be ordered yet. Returns (rows, next_cursor); next_cursor
+    is None on the last page. `sort_key` is the public sort name and is baked
+    into the cursor so a cursor can't be replayed against another ordering.
+    The value for the next cursor is read from the row attribute named after
+    the column key, so both ORM entities and labelled column rows work.
+    """
+    limit = clamp_limit(limit)
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort_key)
+        if descending:
+            query = query.filter(tuple_(column, id_column) < tuple_(value, last_id))
+        else:
+            query = query.filter(tuple_(column, id_column) > tuple_(value, last_id))
+
+    if descending:
+        query = query.order_by(column.desc(), id_column.desc())
+    else:
+        query = query.order_by(column.asc(), id_column.asc())
+
+    rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            sort_key,
+            getattr(last, column.key),
+            getattr(last, id_column.key)
+        )
+
+    return rows, next_cursor
+
+
+# ==================== OFFSET PAGINATION ====================
+
+COUNT_MODES = ('exact', 'cached', 'none')
+COUNT_CACHE_TTL = 30  # seconds
+COUNT_CACHE_SIZE = 1024
+
+# Arguments that change which page is shown but not how many rows match
+_PAGE_ARGS = {'page', 'per_page', 'sort', 'order', 'fields', 'count', 'cursor', 'limit'}
+
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+
+class Page:
+    """One page of results. total/pages are None when counting was skipped."""
+
+    def __init__(self, items, page, per_page, total, has_next):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.pages = -(-total // per_page) if total is not None else None
+        self.has_next = has_next
+
+
+def count_cache_key(endpoint, args):
+    """Key a count by endpoint and the normalized filter arguments"""
+    filters = sorted(
+        (k, v.strip()) for k, v in args.items(multi=True)
+        if k not in _PAGE_ARGS and v.strip()
+    )
+    return endpoint, tuple(filters)
+
+
+def _cached_count(query, cache_key):
+    now = time.monotonic()
+    with _count_cache_lock:
+        hit = _count_cache.get(cache_key)
+        if hit and hit[0] > now:
+            return hit[1]
+
+    total = query.order_by(None).count()
+
+    with _count_cache_lock:
+        if len(_count_cache) >= COUNT_CACHE_SIZE:
+            expired = [k for k, (expires, _) in _count_cache.items() if expires <= now]
+            for key in expired or list(_count_cache)[:COUNT_CACHE_SIZE // 4]:
+                del _count_cache[key]
+        _count_cache[cache_key] = (now + COUNT_CACHE_TTL, total)
+    return total
+
+
+def paginate(query, page, per_page, count='exact', cache_key=None):
+    """
+    OFFSET pagination with a choice of how the total is computed.
+
+    - exact: COUNT(*) on every call (what Query.paginate does)
+    - cached: COUNT(*) reused for COUNT_CACHE_TTL seconds per cache_key
+    - none: no COUNT at all; per_page + 1 rows are fetched to get has_next
+    """
+    page = max(page or 1, 1)
+    per_page = per_page if per_page and per_page > 0 else 20
+
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if not has_next and (rows or page == 1):
+        total = (page - 1) * per_page + len(rows)  # last page: the total is known
+    elif count == 'none':
+        total = None
+    elif count == 'cached' and cache_key is not None:
+        total = _cached_count(query, cache_key)
+    else:
+        total = query.order_by(None).count()
+
+    return Page(rows, page, per_page, total, has_next)
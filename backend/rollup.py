@@ -0,0 +1,200 @@
+"""
+Daily sales rollups (daily_sales, daily_product_sales) and customer
+sketches (customer_sketches) for the admin dashboard, keyed by
+Beirut-local day.
+
+A day's rows are rebuilt from its orders whenever one of them changes:
+the outbox worker collects the days touched by order.created and
+order.changed events and refreshes each once per batch. That keeps the
+rollup exact through status changes, edits and deletes while each
+refresh only reads one day of orders.
+
+Backfill or repair a range from the command line:
+
+    python rollup.py                                 # every day with orders
+    python rollup.py --from 2025-01-01 --to 2025-03-31
+"""
+import argparse
+from datetime import date, datetime, timedelta
+from sqlalchemy import Date, and_, cast, delete, func, insert, literal_column, or_, select
+from hll import HyperLogLog
+from models import db, CustomerSketch, DailyProductSales, DailySales, Order, OrderItem, OutboxEvent, lebanon_tz
+
+REBUILD_CHUNK_DAYS = 31  # days rebuilt per transaction by the CLI
+ROLLUP_LOCK = 2401  # advisory lock classes for per-day and per-month refreshes
+ROLLUP_MONTH_LOCK = 2402
+
+# Beirut-local calendar day of an order. The zone is a literal so the
+# expression is identical in SELECT and GROUP BY.
+order_day = cast(func.timezone(literal_column(f"'{lebanon_tz.zone}'"), Order.created_at), Date)
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (month_start(day) + timedelta(days=32)).replace(day=1)
+
+
+def day_start(day):
+    """Start of a Beirut-local day as an aware datetime (DST aware)"""
+    return lebanon_tz.localize(datetime.combine(day, datetime.min.time()))
+
+
+def sales_day(created_at):
+    """The rollup day an order belongs to"""
+    return created_at.astimezone(lebanon_tz).date()
+
+
+def orders_changed(orders):
+    """
+    Outbox events asking the worker to refresh the rollup days of
+    `orders` (anything with id and created_at), one event per day.
+    """
+    by_day = {}
+    for order in orders:
+        by_day.setdefault(sales_day(order.created_at), []).append(order.id)
+    return [
+        OutboxEvent(event_type='order.changed', payload={'order_ids': ids, 'day': day.isoformat()})
+        for day, ids in by_day.items()
+    ]
+
+
+def refresh_days(days):
+    """
+    Rebuild the rollup rows of `days` from orders, in the caller's
+    transaction. Days (then their months) are locked first, always in
+    the same order, so concurrent refreshes of the same day run one
+    after the other instead of inserting twice.
+    """
+    days = sorted(set(days))
+    if not days:
+        return
+    months = sorted({month_start(day) for day in days})
+
+    for day in days:
+        db.session.execute(select(func.pg_advisory_xact_lock(ROLLUP_LOCK, day.toordinal())))
+    for month in months:
+        db.session.execute(select(func.pg_advisory_xact_lock(ROLLUP_MONTH_LOCK, month.toordinal())))
+
+    # Range predicates on created_at, so the refresh uses ix_orders_created_at_id
+    in_days = or_(*[
+        and_(Order.created_at >= day_start(day), Order.created_at < day_start(day + timedelta(days=1)))
+        for day in days
+    ])
+    status = func.coalesce(Order.status, '')
+
+    db.session.execute(delete(DailySales).where(DailySales.day.in_(days)))
+    db.session.execute(delete(DailyProductSales).where(DailyProductSales.day.in_(days)))
+
+    db.session.execute(insert(DailySales).from_select(
+        ['day', 'status', 'orders', 'revenue', 'units'],
+        select(order_day, status, func.count(Order.id), func.sum(Order.total), func.sum(Order.item_count))
+        .where(in_days)
+        .group_by(order_day, status)
+    ))
+    db.session.execute(insert(DailyProductSales).from_select(
+        ['day', 'status', 'product_id', 'units', 'revenue'],
+        select(order_day, status, OrderItem.product_id, func.sum(OrderItem.quantity), func.sum(OrderItem.subtotal))
+        .join(Order, Order.id == OrderItem.order_id)
+        .where(in_days)
+        .group_by(order_day, status, OrderItem.product_id)
+    ))
+
+    refresh_customer_sketches(days, months, in_days)
+
+
+def refresh_customer_sketches(days, months, in_days):
+    """Rebuild the day sketches from order phones, then their months from the days"""
+    sketches = {}
+    for day, phone in db.session.execute(select(order_day, Order.customer_phone).where(in_days)):
+        sketches.setdefault(day, HyperLogLog()).add(phone)
+
+    db.session.execute(delete(CustomerSketch).where(CustomerSketch.period == 'day', CustomerSketch.start.in_(days)))
+    db.session.execute(delete(CustomerSketch).where(CustomerSketch.period == 'month', CustomerSketch.start.in_(months)))
+    if sketches:
+        db.session.execute(insert(CustomerSketch), [
+            {'period': 'day', 'start': day, 'registers': sketch.to_bytes()}
+            for day, sketch in sketches.items()
+        ])
+
+    month_sketches = {}
+    for row in db.session.query(CustomerSketch.start, CustomerSketch.registers).filter(
+        CustomerSketch.period == 'day',
+        or_(*[and_(CustomerSketch.start >= month, CustomerSketch.start < next_month(month)) for month in months])
+    ):
+        month_sketches.setdefault(month_start(row.start), HyperLogLog()).merge(HyperLogLog(row.registers))
+    if month_sketches:
+        db.session.execute(insert(CustomerSketch), [
+            {'period': 'month', 'start': month, 'registers': sketch.to_bytes()}
+            for month, sketch in month_sketches.items()
+        ])
+
+
+def distinct_customers(first_day=None, last_day=None):
+    """
+    Approximate number of distinct customer phones that ordered between
+    two Beirut-local days (inclusive), or ever when both are None. Whole
+    months inside the range use the month sketch, so at most ~60 day
+    sketches are merged whatever the range.
+    """
+    if first_day is None and last_day is None:
+        condition = CustomerSketch.period == 'month'
+    else:
+        first_full = first_day if first_day.day == 1 else next_month(first_day)
+        edge = month_start(last_day + timedelta(days=1))  # months before this end inside the range
+        if first_full < edge:
+            condition = or_(
+                and_(CustomerSketch.period == 'month', CustomerSketch.start >= first_full, CustomerSketch.start < edge),
+                and_(
+                    CustomerSketch.period == 'day',
+                    or_(
+                        and_(CustomerSketch.start >= first_day, CustomerSketch.start < first_full),
+                        and_(CustomerSketch.start >= edge, CustomerSketch.start <= last_day)
+                    )
+                )
+            )
+        else:
+            condition = and_(
+                CustomerSketch.period == 'day',
+                CustomerSketch.start >= first_day,
+                CustomerSketch.start <= last_day
+            )
+
+    sketch = HyperLogLog()
+    for (registers,) in db.session.query(CustomerSketch.registers).filter(condition):
+        sketch.merge(HyperLogLog(registers))
+    return sketch.count()
+
+
+def rebuild(first_day=None, last_day=None):
+    """Rebuild an inclusive range of days (default: every day with orders), committing per chunk"""
+    if first_day is None or last_day is None:
+        oldest, newest = db.session.query(func.min(Order.created_at), func.max(Order.created_at)).one()
+        if oldest is None:
+            return 0
+        first_day = first_day or sales_day(oldest)
+        last_day = last_day or sales_day(newest)
+
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    for i in range(0, len(days), REBUILD_CHUNK_DAYS):
+        refresh_days(days[i:i + REBUILD_CHUNK_DAYS])
+        db.session.commit()
+    return len(days)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill or rebuild the daily sales rollups')
+    parser.add_argument('--from', dest='first_day', type=date.fromisoformat, help='first day, YYYY-MM-DD')
+    parser.add_argument('--to', dest='last_day', type=date.fromisoformat, help='last day, YYYY-MM-DD')
+    args = parser.parse_args()
+
+    from app import app  # not at module level: the blueprints import this module
+    with app.app_context():
+        count = rebuild(args.first_day, args.last_day)
+    print(f"Rebuilt {count} day(s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+from flask import current_app, jsonify
+from models import Product
+from category_cache import category_cache
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib encoder
+    orjson = None
+
+
+# ==================== FIELD SPECS ====================
+#
+# A field spec maps each response key to (columns, getter): the columns the
+# value is built from and a function turning a row (or ORM object) into the
+# value. The same table drives the SELECT list and the JSON, so `?fields=`
+# trims both.
+
+def column_field(column, convert=None):
+    """Spec entry that reads a single column, optionally converting it"""
+    key = column.key
+    if convert is None:
+        return (column,), lambda row: getattr(row, key)
+    return (column,), lambda row: convert(getattr(row, key))
+
+
+def product_type_field(with_gender=False):
+    """
+    Spec entry for a product's type, read from the category cache so catalog
+    queries only need products.product_type_id (no joins)
+    """
+    def getter(row):
+        pt = category_cache.product_type(row.product_type_id)
+        data = {'id': pt.id, 'name': pt.name, 'slug': pt.slug}
+        if with_gender:
+            data['gender'] = _gender_json(pt.gender_id)
+        return data
+    return (Product.product_type_id,), getter
+
+
+def gender_field():
+    """Spec entry for a product's gender, read from the category cache"""
+    def getter(row):
+        return _gender_json(category_cache.product_type(row.product_type_id).gender_id)
+    return (Product.product_type_id,), getter
+
+
+def _gender_json(gender_id):
+    g = category_cache.gender(gender_id)
+    return {'id': g.id, 'name': g.name, 'slug': g.slug}
+
+
+def parse_fields(raw, spec):
+    """
+    Parse a comma-separated `fields` parameter against a spec.
+    Returns None when every field is wanted; raises ValueError on unknown names.
+    """
+    if raw is None:
+        return None
+
+    fields = {f.strip() for f in raw.split(',') if f.strip()}
+    unknown = fields - spec.keys()
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    return fields or None
+
+
+def columns_for(spec, fields, *always):
+    """Columns needed to render `fields`, plus any the caller always needs"""
+    columns = list(always)
+    for name, (field_columns, _) in spec.items():
+        if fields is None or name in fields:
+            for column in field_columns:
+                if not any(column is seen for seen in columns):
+                    columns.append(column)
+    return columns
+
+
+def render(row, spec, fields=None):
+    """Build the response dict for one row, limited to `fields`"""
+    return {
+        name: getter(row)
+        for name, (_, getter) in spec.items()
+        if fields is None or name in fields
+    }
+
+
+def float_or_none(value):
+    return float(value) if value else None
+
+
+def str_or_none(value):
+    return str(value) if value else None
+
+
+def isoformat_or_none(value):
+    return value.isoformat() if value else None
+
+
+# ==================== JSON ====================
+
+def json_response(payload):
+    """
+    Drop-in replacement for jsonify() on large catalog payloads.
+
+    Encodes with orjson when it is installed and produces the same bytes the
+    app's JSON provider would: sorted keys, compact or indented depending on
+    the provider settings, trailing newline. Bodies with non-ASCII characters
+    go through jsonify() when the provider escapes them, so the output never
+    depends on which encoder ran.
+    """
+    provider = current_app.json
+    if orjson is None:
+        return jsonify(payload)
+
+    option = orjson.OPT_SORT_KEYS if provider.sort_keys else 0
+    if provider.compact is False or (provider.compact is None and current_app.debug):
+        option |= orjson.OPT_INDENT_2
+
+    try:
+        body = orjson.dumps(payload, option=option)
+    except TypeError:
+        return jsonify(payload)
+
+    if provider.ensure_ascii and not body.isascii():
+        return jsonify(payload)
+
+    return current_app.response_class(body + b'\n', mimetype=provider.mimetype)
@@ -0,0 +1,124 @@
+import threading
+import time
+from flask import current_app
+from catalog_version import catalog_version
+from models import db, Product, ProductType, Gender
+from sqlalchemy import func
+
+MAX_SUGGESTIONS = 10
+MAX_PREFIX = 16         # longer queries are matched against the 16-char bucket
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+
+class SuggestIndex:
+    """
+    Typeahead over product titles, product type names and gender names.
+
+    Every prefix (up to MAX_PREFIX chars) of every word-start suffix of a
+    term maps to that prefix's top MAX_SUGGESTIONS entries by sales, so a
+    lookup is one dict access plus a short scan.
+
+    A stale index keeps serving lookups while a single background thread
+    rebuilds it; only the very first lookup waits for a build.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()  # held by whoever is rebuilding
+        self._prefixes = None
+        self._built_at = None
+        self._version = None
+
+    def rebuild(self):
+        version = catalog_version.value  # a bump during the build triggers another
+        entries = []
+
+        for p in db.session.query(Product.id, Product.title, Product.sales_count):
+            entries.append((p.sales_count or 0, {'type': 'product', 'id': p.id, 'text': p.title}))
+
+        type_sales = dict(
+            db.session.query(Product.product_type_id, func.coalesce(func.sum(Product.sales_count), 0))
+            .group_by(Product.product_type_id)
+            .all()
+        )
+        gender_sales = {}
+        types = (
+            db.session.query(ProductType.id, ProductType.name, ProductType.slug, ProductType.gender_id, Gender.name.label('gender_name'))
+            .join(Gender)
+            .all()
+        )
+        for pt in types:
+            sales = int(type_sales.get(pt.id, 0))
+            gender_sales[pt.gender_id] = gender_sales.get(pt.gender_id, 0) + sales
+            entries.append((sales, {'type': 'product_type', 'slug': pt.slug, 'text': pt.name, 'gender': pt.gender_name}))
+
+        for g in db.session.query(Gender.id, Gender.name, Gender.slug):
+            entries.append((gender_sales.get(g.id, 0), {'type': 'gender', 'slug': g.slug, 'text': g.name}))
+
+        # Highest weight first, so each prefix list is built already ranked
+        entries.sort(key=lambda e: e[0], reverse=True)
+
+        prefixes = {}
+        for weight, entry in entries:
+            term = normalize(entry['text'])
+            seen = set()
+            starts = [0] + [i + 1 for i, ch in enumerate(term) if ch == ' ']
+            for start in starts:
+                suffix = term[start:start + MAX_PREFIX]
+                for end in range(1, len(suffix) + 1):
+                    prefix = suffix[:end]
+                    if prefix in seen:
+                        continue
+                    seen.add(prefix)
+                    bucket = prefixes.setdefault(prefix, [])
+                    if len(bucket) < MAX_SUGGESTIONS:
+                        bucket.append((term, entry))
+
+        with self._lock:
+            self._prefixes = prefixes
+            self._built_at = time.monotonic()
+            self._version = version
+
+    def _ensure_fresh(self):
+        if catalog_version.is_current(self._version, self._built_at):
+            return
+
+        if self._prefixes is None:
+            # Nothing to serve yet: build once, other requests wait for it
+            with self._rebuild_lock:
+                if self._prefixes is None:
+                    self.rebuild()
+            return
+
+        # Stale: at most one rebuild at a time, off the request path
+        if self._rebuild_lock.acquire(blocking=False):
+            app = current_app._get_current_object()
+            threading.Thread(target=self._rebuild_in_background, args=(app,), daemon=True).start()
+
+    def _rebuild_in_background(self, app):
+        try:
+            with app.app_context():
+                self.rebuild()
+        except Exception as e:
+            print(f"Suggest index rebuild failed: {e}")
+        finally:
+            self._rebuild_lock.release()
+
+    def suggest(self, text, limit=MAX_SUGGESTIONS):
+        self._ensure_fresh()
+
+        query = normalize(text)
+        if not query:
+            return []
+
+        bucket = self._prefixes.get(query[:MAX_PREFIX], [])
+        if len(query) > MAX_PREFIX:
+            bucket = [(term, entry) for term, entry in bucket if f' {query}' in f' {term}']
+
+        return [entry for _, entry in bucket[:limit]]
+
+
+suggest_index = SuggestIndex()
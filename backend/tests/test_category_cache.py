@@ -0,0 +1,39 @@
+import category_cache as category_cache_module
+from catalog_version import catalog_version
+from category_cache import category_cache
+from models import db, Gender, ProductType
+
+
+def add_category_elsewhere(app, gender_slug, type_slug):
+    """A category created through another worker: the catalog version here isn't bumped"""
+    with app.app_context():
+        gender = Gender(name=gender_slug.title(), slug=gender_slug)
+        db.session.add(ProductType(name=type_slug.title(), slug=type_slug, gender=gender))
+        db.session.commit()
+        return gender.id
+
+
+def test_slug_miss_reloads_the_cache(app, make_product, monkeypatch):
+    make_product(gender='Men', product_type='Shirts')
+    with app.app_context():
+        category_cache.product_type_ids('men')  # cache built without the new category
+    gender_id = add_category_elsewhere(app, 'kids', 'kids-shoes')
+
+    monkeypatch.setattr(category_cache_module, 'MISS_REFRESH_INTERVAL', 0)
+    with app.app_context():
+        assert category_cache.gender_by_slug('kids').id == gender_id
+        assert len(category_cache.product_type_ids(product_type_slug='kids-shoes')) == 1
+
+
+def test_unknown_slugs_reload_at_most_once_per_interval(app, make_product, monkeypatch):
+    make_product(gender='Men', product_type='Shirts')
+    refreshes = []
+    refresh = category_cache.refresh
+    monkeypatch.setattr(category_cache, 'refresh', lambda: refreshes.append(1) or refresh())
+
+    with app.app_context():
+        catalog_version.bump()
+        for i in range(20):
+            assert category_cache.product_type_ids(f'unknown-{i}') == []
+            assert category_cache.gender_by_slug(f'unknown-{i}') is None
+    assert len(refreshes) == 1
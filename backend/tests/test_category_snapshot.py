@@ -0,0 +1,26 @@
+import category_snapshot
+from category_snapshot import category_snapshots
+
+
+def test_unknown_gender_hero_is_not_cached(app, client, make_product):
+    make_product(images=['men.jpg'])
+    assert client.get('/api/categories/').status_code == 200
+    assert client.get('/api/search/gender-hero/men').get_json()['image'] == 'men.jpg'
+    cached = set(category_snapshots._snapshots)
+
+    for i in range(category_snapshot.MAX_SNAPSHOTS + 10):
+        response = client.get(f'/api/search/gender-hero/nope-{i}')
+        assert response.status_code == 200
+        assert response.get_json() == {'image': None, 'title': None, 'product_type': None}
+
+    assert set(category_snapshots._snapshots) == cached
+
+
+def test_full_cache_evicts_oldest_snapshot_only(app, monkeypatch):
+    monkeypatch.setattr(category_snapshot, 'MAX_SNAPSHOTS', 3)
+    monkeypatch.setattr(category_snapshots, '_snapshots', {})
+    with app.test_request_context():
+        for key in ['categories', 'genders', 'a', 'b']:
+            category_snapshots.get(key, lambda: {'key': key})
+
+    assert list(category_snapshots._snapshots) == ['genders', 'a', 'b']
@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import outbox_worker
+from models import db, Order, OutboxEvent, Product, ProductVariant
+
+CHECKOUTS = 200
+STOCK = 50
+WORKERS = 12  # below the default pool size + overflow, so no pool timeouts
+
+
+def cart(product_id, quantity=1, size='M', color='Black'):
+    return {
+        'customer_name': 'Test Customer',
+        'customer_phone': '+961 70 123 456',
+        'address_line1': 'Hamra St',
+        'city': 'Beirut',
+        'items': [{'product_id': product_id, 'quantity': quantity, 'size': size, 'color': color}]
+    }
+
+
+def checkout_all(app, payloads):
+    """POST every cart from WORKERS threads at once; returns the status codes"""
+    def checkout(payload):
+        with app.test_client() as client:
+            return client.post('/api/orders/', json=payload).status_code
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        return list(pool.map(checkout, payloads))
+
+
+def variant_stock(app, product_id):
+    with app.app_context():
+        return db.session.scalar(
+            db.select(ProductVariant.stock_quantity).filter_by(product_id=product_id)
+        )
+
+
+def product_in_stock(app, product_id):
+    with app.app_context():
+        return db.session.get(Product, product_id).in_stock
+
+
+def test_concurrent_checkouts_never_oversell(app, make_product):
+    product_id = make_product(variants=[('M', 'Black', STOCK)])
+
+    statuses = checkout_all(app, [cart(product_id)] * CHECKOUTS)
+
+    assert statuses.count(201) == STOCK
+    assert statuses.count(400) == CHECKOUTS - STOCK
+    assert variant_stock(app, product_id) == 0
+    with app.app_context():
+        assert Order.query.count() == STOCK
+    assert product_in_stock(app, product_id) is False
+
+
+def test_cancel_and_delete_return_stock(app, client, make_product, admin_headers):
+    product_id = make_product(variants=[('M', 'Black', 3)])
+    first = client.post('/api/orders/', json=cart(product_id, quantity=2)).get_json()['order']['id']
+    second = client.post('/api/orders/', json=cart(product_id)).get_json()['order']['id']
+    assert variant_stock(app, product_id) == 0
+    assert product_in_stock(app, product_id) is False
+
+    response = client.put(f'/api/admin/orders/{first}/status', json={'status': 'cancelled'}, headers=admin_headers)
+    assert response.status_code == 200
+    assert variant_stock(app, product_id) == 2
+    assert product_in_stock(app, product_id) is True
+
+    # Cancelling twice must not return the stock twice
+    client.put(f'/api/admin/orders/{first}/status', json={'status': 'cancelled'}, headers=admin_headers)
+    assert variant_stock(app, product_id) == 2
+
+    response = client.delete(f'/api/admin/orders/{second}', headers=admin_headers)
+    assert response.status_code == 200
+    assert variant_stock(app, product_id) == 3
+
+    # Deleting the already-cancelled order gives nothing back again
+    response = client.post('/api/admin/orders/bulk-delete', json={'order_ids': [first]}, headers=admin_headers)
+    assert response.get_json()['deleted_ids'] == [first]
+    assert variant_stock(app, product_id) == 3
+
+
+def test_uncancel_retakes_stock_or_refuses(app, client, make_product, admin_headers):
+    product_id = make_product(variants=[('M', 'Black', 2)])
+    order_id = client.post('/api/orders/', json=cart(product_id, quantity=2)).get_json()['order']['id']
+
+    response = client.put('/api/admin/orders/bulk-status', json={'order_ids': [order_id], 'status': 'cancelled'}, headers=admin_headers)
+    assert response.status_code == 200
+    assert variant_stock(app, product_id) == 2
+
+    # Someone else buys one unit; the cancelled order can't be revived
+    assert client.post('/api/orders/', json=cart(product_id)).status_code == 201
+    response = client.put('/api/admin/orders/bulk-status', json={'order_ids': [order_id], 'status': 'pending'}, headers=admin_headers)
+    assert response.status_code == 400
+    assert variant_stock(app, product_id) == 1
+    with app.app_context():
+        assert db.session.get(Order, order_id).status == 'cancelled'
+
+
+def test_parallel_checkouts_then_drain_count_every_sale(app, make_product):
+    stocked = make_product(title='Denim Jacket', variants=[('M', 'Black', 1000)])
+    plain = make_product(title='Canvas Tote')  # no variants, never sells out
+    carts = [
+        {**cart(stocked), 'items': [
+            {'product_id': stocked, 'quantity': i % 3 + 1, 'size': 'M', 'color': 'Black'},
+            {'product_id': plain, 'quantity': 2},
+        ]}
+        for i in range(90)
+    ]
+
+    assert checkout_all(app, carts) == [201] * len(carts)
+
+    # Several workers drain the outbox side by side, as in production
+    def work(_):
+        with app.app_context():
+            while outbox_worker.drain(batch_size=7):
+                pass
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(work, range(4)))
+
+    with app.app_context():
+        assert OutboxEvent.query.filter(OutboxEvent.processed_at.is_(None)).count() == 0
+        assert db.session.get(Product, stocked).sales_count == sum(i % 3 + 1 for i in range(90))
+        assert db.session.get(Product, plain).sales_count == 2 * len(carts)
+
+
+def test_unreserved_order_never_moves_stock(app, client, make_product, admin_headers):
+    """An order placed before the product had variants reserved nothing"""
+    product_id = make_product()
+    order_id = client.post('/api/orders/', json=cart(product_id, quantity=3)).get_json()['order']['id']
+
+    response = client.put(f'/api/admin/products/{product_id}', json={
+        'variants': [{'size': 'M', 'color': 'Black', 'stock_quantity': 5}]
+    }, headers=admin_headers)
+    assert response.status_code == 200
+
+    client.put(f'/api/admin/orders/{order_id}/status', json={'status': 'cancelled'}, headers=admin_headers)
+    assert variant_stock(app, product_id) == 5
+
+    response = client.put(f'/api/admin/orders/{order_id}/status', json={'status': 'pending'}, headers=admin_headers)
+    assert response.status_code == 200
+    assert variant_stock(app, product_id) == 5
+
+    client.delete(f'/api/admin/orders/{order_id}', headers=admin_headers)
+    assert variant_stock(app, product_id) == 5
+
+
+def test_malformed_product_id_is_not_found(app, client, make_product):
+    product_id = make_product()
+    assert product_id == 1
+
+    for bad in [1.5, True, '1.9', ' 1', None]:
+        response = client.post('/api/orders/', json={**cart(product_id), 'items': [{'product_id': bad, 'quantity': 1}]})
+        assert response.status_code == 404, bad
+
+    response = client.post('/api/orders/', json={**cart(product_id), 'items': [{'product_id': '1', 'quantity': 1}]})
+    assert response.status_code == 201
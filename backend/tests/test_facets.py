@@ -0,0 +1,37 @@
+import pytest
+
+from catalog_version import catalog_version
+from facets import facet_index
+from models import db, Product
+
+
+def facets(app, gender='men'):
+    with app.app_context():
+        return facet_index.facets(gender)
+
+
+def test_saved_product_is_applied_without_a_rebuild(app, make_product, monkeypatch):
+    make_product(price=40, sizes=['M'], colors=['black'])
+    facets(app)
+
+    monkeypatch.setattr(facet_index, 'rebuild', lambda: pytest.fail('rebuilt the facet index'))
+    make_product(title='Wool Coat', price=90, sizes=['L'], colors=['grey'])
+    sizes, colors, low, high = facets(app)
+    assert (dict(sizes), dict(colors), low, high) == ({'M': 1, 'L': 1}, {'black': 1, 'grey': 1}, 40, 90)
+
+
+def test_missed_write_rebuilds_on_next_lookup(app, make_product):
+    make_product(price=40, sizes=['M'], colors=['black'])
+    facets(app)
+
+    with app.app_context():
+        # Written through another path: the version moves, the index isn't told
+        db.session.add(Product(title='Wool Coat', price=90, sizes=['L'], colors=['grey'],
+                               product_type_id=db.session.query(Product.product_type_id).scalar()))
+        db.session.commit()
+    catalog_version.bump()
+    make_product(title='Linen Scarf', price=15, sizes=['S'], colors=['white'])
+
+    sizes, colors, low, high = facets(app)
+    assert set(sizes) == {'M', 'L', 'S'}
+    assert (low, high) == (15, 90)
@@ -0,0 +1,87 @@
+"""
+The catalog filters must stay indexable: size/color overlap (&&) on the
+GIN indexes and slug lookups on plain btree equality. Sequential scans
+are switched off for each EXPLAIN, so a seq scan in the plan means no
+index can serve the predicate at all (e.g. lower(slug) or an OR of
+array contains() slipped back in).
+
+The size/color checks EXPLAIN the SQL the endpoints actually send,
+captured with a before_cursor_execute listener.
+"""
+import pytest
+from sqlalchemy import event
+
+from models import db, Gender, ProductType
+
+
+def explain(statement, parameters=None):
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql('SET LOCAL enable_seqscan = off')  # undone when the connection rolls back
+        rows = conn.exec_driver_sql(f'EXPLAIN {statement}', parameters).all()
+    return '\n'.join(row[0] for row in rows)
+
+
+def plan(query):
+    statement = query.statement.compile(dialect=db.engine.dialect)
+    return explain(str(statement), statement.params)
+
+
+def filter_statements(app, client, url, column):
+    """The (statement, parameters) a request sends that filter on products.<column>"""
+    captured = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        where = statement.partition('WHERE')[2]
+        if f'products.{column}' in where:
+            captured.append((statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        assert client.get(url).status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return captured
+
+
+@pytest.mark.parametrize('url, column, index', [
+    ('/api/products/?sizes=M', 'sizes', 'ix_products_sizes'),
+    ('/api/products/?colors=black', 'colors', 'ix_products_colors'),
+    ('/api/search/products?sizes=M', 'sizes', 'ix_products_sizes'),
+    ('/api/search/products?colors=black', 'colors', 'ix_products_colors'),
+    ('/api/products/?sizes=M&colors=black', 'sizes', 'ix_products_'),
+    ('/api/search/products?sizes=M&colors=black', 'sizes', 'ix_products_'),
+])
+def test_endpoint_filter_uses_gin_index(app, client, make_product, url, column, index):
+    make_product(sizes=['S', 'M'], colors=['black', 'white'])
+
+    statements = filter_statements(app, client, url, column)
+    assert statements, f'{url} sent no query filtering on {column}'
+    with app.app_context():
+        for statement, parameters in statements:
+            explained = explain(statement, parameters)
+            assert index in explained, explained
+            assert 'Seq Scan on products' not in explained, explained
+
+
+@pytest.mark.parametrize('query, index', [
+    (lambda: ProductType.query.filter(ProductType.slug == 'shirts'), 'ix_product_types_slug'),
+    (lambda: Gender.query.filter(Gender.slug == 'men'), 'genders_slug_key'),
+])
+def test_slug_lookup_uses_index(app, make_product, query, index):
+    make_product()
+
+    with app.app_context():
+        explained = plan(query())
+
+    assert index in explained, explained
+    assert 'Seq Scan' not in explained, explained
+
+
+def test_lowercased_slug_would_not_use_index(app):
+    """Guards the check above: lower(column) can't use the slug index"""
+    with app.app_context():
+        explained = plan(ProductType.query.filter(db.func.lower(ProductType.slug) == 'shirts'))
+
+    assert 'ix_product_types_slug' not in explained, explained
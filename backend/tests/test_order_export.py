@@ -0,0 +1,43 @@
+import csv
+import io
+import json
+
+
+def place(client, product_id, **fields):
+    payload = {
+        'customer_name': 'Test Customer',
+        'customer_phone': '+961 70 123 456',
+        'address_line1': 'Hamra St',
+        'city': 'Beirut',
+        'items': [{'product_id': product_id, 'quantity': 1}],
+        **fields
+    }
+    assert client.post('/api/orders/', json=payload).status_code == 201
+
+
+def test_csv_export_escapes_formulas(app, client, make_product, admin_headers):
+    product_id = make_product()
+    place(client, product_id, customer_name='=HYPERLINK("http://evil.example","x")',
+          address_line1='+SUM(A1:A9)', city='@cmd')
+    place(client, product_id, customer_name='-Ali', address_line1='\tTab St', city='-12.5')
+
+    # Streamed: closing the response ends its request (and transaction)
+    with client.get('/api/admin/orders/export', headers=admin_headers) as response:
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+
+    assert [(r['customer_name'], r['address_line1'], r['city']) for r in rows] == [
+        ('\'=HYPERLINK("http://evil.example","x")', "'+SUM(A1:A9)", "'@cmd"),
+        ("'-Ali", "'\tTab St", '-12.5'),
+    ]
+    # Phone numbers and money amounts are left alone
+    assert {r['customer_phone'] for r in rows} == {'+961 70 123 456'}
+    assert rows[0]['total'] == '50.00'
+
+
+def test_ndjson_export_is_not_escaped(app, client, make_product, admin_headers):
+    product_id = make_product()
+    place(client, product_id, customer_name='=1+1')
+
+    with client.get('/api/admin/orders/export?format=ndjson', headers=admin_headers) as response:
+        order = json.loads(response.get_data(as_text=True).splitlines()[0])
+    assert order['customer_name'] == '=1+1'
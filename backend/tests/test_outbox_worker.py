@@ -0,0 +1,89 @@
+from sqlalchemy import func, update
+
+import outbox_worker
+from models import db, OutboxEvent
+
+
+def order(product_id):
+    return {
+        'customer_name': 'Test Customer',
+        'customer_phone': '+961 70 123 456',
+        'address_line1': 'Hamra St',
+        'city': 'Beirut',
+        'items': [{'product_id': product_id, 'quantity': 1}]
+    }
+
+
+def drain_once(app):
+    """One batch, as one poll of the worker loop handles it"""
+    with app.app_context():
+        return outbox_worker.drain()
+
+
+def driver_event(app):
+    with app.app_context():
+        return OutboxEvent.query.filter_by(event_type='driver.notify').one()
+
+
+def test_failed_driver_notification_is_retried(app, client, make_product, monkeypatch):
+    product_id = make_product()
+    assert client.post('/api/orders/', json=order(product_id)).status_code == 201
+
+    sent = []
+
+    def down(info):
+        raise ConnectionError('gateway down')
+
+    monkeypatch.setattr(outbox_worker.notifier, 'send', down)
+    drain_once(app)  # order.created, which queues driver.notify
+    drain_once(app)
+    event = driver_event(app)
+    assert event.processed_at is None
+    assert event.attempts == 1
+    assert 'gateway down' in event.last_error
+
+    monkeypatch.setattr(outbox_worker.notifier, 'send', sent.append)
+    drain_once(app)
+    assert driver_event(app).processed_at is not None
+    assert [info['customer_name'] for info in sent] == ['Test Customer']
+
+
+def test_driver_notification_gives_up_after_max_attempts(app, client, make_product, monkeypatch):
+    product_id = make_product()
+    client.post('/api/orders/', json=order(product_id))
+
+    def down(info):
+        raise ConnectionError('gateway down')
+
+    monkeypatch.setattr(outbox_worker.notifier, 'send', down)
+    while drain_once(app):
+        pass
+
+    event = driver_event(app)
+    assert event.processed_at is None
+    assert event.attempts == outbox_worker.MAX_ATTEMPTS
+
+
+def test_purge_keeps_pending_and_recent_events(app, client, make_product):
+    product_id = make_product()
+    client.post('/api/orders/', json=order(product_id))
+    drain_once(app)
+    drain_once(app)
+    client.post('/api/orders/', json=order(product_id))  # order.created still pending
+
+    with app.app_context():
+        # Age one processed event past the retention window
+        old_id = db.session.scalar(
+            db.select(func.min(OutboxEvent.id)).where(OutboxEvent.processed_at.isnot(None))
+        )
+        db.session.execute(
+            update(OutboxEvent).where(OutboxEvent.id == old_id)
+            .values(processed_at=func.now() - outbox_worker.OUTBOX_RETENTION * 2)
+        )
+        db.session.commit()
+        before = OutboxEvent.query.count()
+
+        assert outbox_worker.purge_processed_events() == 1
+        assert OutboxEvent.query.count() == before - 1
+        assert db.session.get(OutboxEvent, old_id) is None
+        assert OutboxEvent.query.filter(OutboxEvent.processed_at.is_(None)).count() == 1
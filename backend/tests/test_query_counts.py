@@ -0,0 +1,101 @@
+from contextlib import contextmanager
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+from catalog_version import catalog_version
+from models import db, DailyProductSales
+
+# (gender, product type, slug) of product i is CATALOG[i % 3]
+CATALOG = [('Men', 'Shirts', 'men-shirts'), ('Women', 'Shirts', 'women-shirts'), ('Men', 'Jackets', 'men-jackets')]
+MANY = 15
+
+
+def products(key):
+    return lambda body: len(body[key])
+
+
+def product_counts(key):
+    """Category listings: products counted across their product types"""
+    def rows(body):
+        types = [t for c in body[key] for t in c.get('product_types', [c])]
+        return sum(t['product_count'] for t in types)
+    return rows
+
+
+# (url, rows in the response, which catalog entries it lists, row cap).
+# per_page is raised where a listing pages, so MANY products fit on one page.
+LISTINGS = [
+    ('/api/products/', products('products'), {0, 1, 2}, None),
+    ('/api/products/gender/men', products('products'), {0, 2}, None),
+    ('/api/products/product-type/men-shirts', products('products'), {0}, None),
+    ('/api/search/products?q=shirt&per_page=50', products('products'), {0, 1, 2}, None),
+    ('/api/search/global?q=shirt&per_page=50', products('results'), {0, 1, 2}, None),
+    ('/api/categories/', product_counts('categories'), {0, 1, 2}, None),
+    ('/api/categories/product-types', product_counts('product_types'), {0, 1, 2}, None),
+    ('/api/admin/products?per_page=50', products('products'), {0, 1, 2}, None),
+    ('/api/admin/dashboard/top-products', products('top_products'), {0, 1, 2}, 5),
+]
+
+
+@contextmanager
+def count_queries(app):
+    """Collects every statement the app sends to the database"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def measure(app, client, url, headers, rows):
+    """
+    (queries, rows) for a request, after one request to warm the caches.
+    The catalog version is bumped again so the catalog caches and the
+    category builders are measured rather than served from memory.
+    """
+    assert client.get(url, headers=headers).status_code == 200
+    catalog_version.bump()
+    with count_queries(app) as statements:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return len(statements), rows(response.get_json())
+
+
+def make_catalog(app, make_product, first, last):
+    """Products first..last-1, each with a day of sales for the top-products rollup"""
+    for i in range(first, last):
+        gender, product_type, slug = CATALOG[i % 3]
+        product_id = make_product(title=f'Shirt {i}', gender=gender, product_type=product_type,
+                                  product_type_slug=slug, sizes=['M'], colors=['black'])
+        with app.app_context():
+            db.session.add(DailyProductSales(day=date.today(), status='pending', product_id=product_id,
+                                             units=i + 1, revenue=10 * (i + 1)))
+            db.session.commit()
+
+
+def expected_rows(count, listed, cap):
+    rows = sum(1 for i in range(count) if i % 3 in listed)
+    return min(rows, cap) if cap else rows
+
+
+@pytest.mark.parametrize('url, rows, listed, cap', LISTINGS, ids=[listing[0] for listing in LISTINGS])
+def test_listing_query_count_does_not_grow_with_products(app, client, make_product, admin_headers,
+                                                         url, rows, listed, cap):
+    make_catalog(app, make_product, 0, 1)
+    one, one_rows = measure(app, client, url, admin_headers, rows)
+
+    make_catalog(app, make_product, 1, MANY)
+    many, many_rows = measure(app, client, url, admin_headers, rows)
+
+    assert (one_rows, many_rows) == (expected_rows(1, listed, cap), expected_rows(MANY, listed, cap))
+    assert one > 0, f'{url}: served without touching the database'
+    assert many == one, f'{url}: {one} queries for {one_rows} row(s), {many} for {many_rows}'
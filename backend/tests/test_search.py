@@ -0,0 +1,22 @@
+def titles(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    body = response.get_json()
+    return sorted(p['title'] for p in body.get('products', body.get('results', [])))
+
+
+def test_full_text_search_prefix_matches_words(app, client, make_product):
+    make_product(title='Denim Jacket')
+    make_product(title='Linen Shirt')
+
+    assert titles(client, '/api/search/products?q=den jack') == ['Denim Jacket']
+    assert titles(client, '/api/search/global?q=shirt') == ['Linen Shirt']
+
+
+def test_stop_word_query_falls_back_to_substring_match(app, client, make_product):
+    make_product(title='Leather Jacket')
+    make_product(title='Linen Shirt')
+
+    # "the" is a stop word, so the tsquery is empty; ILIKE still finds "Leather"
+    assert titles(client, '/api/search/products?q=the') == ['Leather Jacket']
+    assert titles(client, '/api/search/global?q=the') == ['Leather Jacket']